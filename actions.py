@@ -37,7 +37,7 @@ def random_direction():
 def add_to_map(new_map, pos, obj):
     obj.pos = pos
     obj.current_map = new_map # not necessarily necessary?
-    new_map.objects.insert(0, obj)
+    new_map.add_object(obj)
 
 
 def move(obj, direction):
@@ -53,7 +53,7 @@ def move(obj, direction):
         # check here for NPCs
         return False
     if not obj.current_map.is_blocked_from(obj.pos, goal):
-        obj.pos = goal
+        obj.current_map.move_object(obj, goal)
         if obj.fighter:
             obj.fighter.exhaustion += MOVE_EXHAUSTION
         return True
@@ -139,6 +139,7 @@ def attack(attacker_ftr, target_obj, report=True):
     Melee absorption: defender's armor soak.
     """
     target_obj.fighter.last_attacker = attacker_ftr.owner
+    target_obj.current_map.wake(target_obj)
     attacker_ftr.exhaustion += ATTACK_EXHAUSTION
 
     a_weapon_skill, a_weapon_eq = _base_combat_skill(attacker_ftr)
@@ -196,6 +197,7 @@ def fire(actor_obj, weapon_eq, ammo_eq, target_obj, report=True):
         unequip(actor_obj, ammo_eq, False)
         actor_obj.inventory.remove(ammo_eq.owner)
     target_obj.fighter.last_attacker = actor_obj
+    target_obj.current_map.wake(target_obj)
     actor_obj.fighter.exhaustion += ATTACK_EXHAUSTION
 
     a_weapon_skill = actor_obj.fighter.skills.get(weapon_eq.owner.missile_weapon.skill, 10)
@@ -258,10 +260,10 @@ def inflict_bleeding(actor_obj, target_ftr, bloodloss):
         log.message(target_ftr.owner.name.capitalize() + ' bleeds!', libtcod.red)
 
 
-def bleed(actor_obj):
+def bleed(actor_obj, turns=1):
     # go into floats here so that we can model bleeding continuously
     # instead of assessing it every 10 turns
-    actor_obj.fighter.hp -= actor_obj.fighter.bleeding / 10.
+    actor_obj.fighter.hp -= actor_obj.fighter.bleeding / 10. * turns
     if actor_obj.fighter.hp <= 0:
         function = actor_obj.fighter.death_function
         if function is not None:
@@ -284,7 +286,7 @@ def pick_up(actor, obj, report=True):
     for match in actor.inventory:
         if obj.item.can_combine(match):
             match.item.count += obj.item.count
-            actor.current_map.objects.remove(obj)
+            actor.current_map.remove_object(obj)
             if report:
                 log.message(actor.name.capitalize() + ' picked up a ' + obj.name + '!', libtcod.green)
             return True
@@ -296,7 +298,7 @@ def pick_up(actor, obj, report=True):
         return False
     else:
         actor.inventory.append(obj)
-        actor.current_map.objects.remove(obj)
+        actor.current_map.remove_object(obj)
         if report:
             if obj.item.count > 1:
                 log.message(actor.name.capitalize() + ' picked up ' + str(obj.item.count) +
@@ -327,8 +329,8 @@ def drop(actor, obj, report=True, drop_all=False):
         actor.inventory.remove(obj)
 
     combined = False
-    for match in actor.current_map.objects:
-        if match.pos == actor.pos and obj.item.can_combine(match):
+    for match in actor.current_map.objects_at(actor.pos):
+        if obj.item.can_combine(match):
             if drop_all:
                 match.item.count += obj.item.count
             else:
@@ -417,9 +419,15 @@ def get_equipped_in_slot(actor, slot):
 
 
 class _MockMap(object):
-    def is_blocked_at(self, pos):
+    width = 100
+    height = 100
+
+    def is_blocked_from(self, origin, dest, ignore=None):
         return False
 
+    def move_object(self, obj, pos):
+        obj.pos = pos
+
 
 def _test_move():
     obj = Object(algebra.Location(0, 0), 'o', 'test object', libtcod.white)
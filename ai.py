@@ -4,10 +4,13 @@ AI routines, AI data, and monster death.
 # Copyright 2016 Thomas C. Hudson
 # Governed by the license described in LICENSE.txt
 import libtcodpy as libtcod
+import math
 
+import algebra
 import log
 from components import *
 import actions
+import pathing
 
 
 # Might make sense to have this defined
@@ -19,14 +22,25 @@ CONFUSE_NUM_TURNS = 10
 # the player leaves view.
 ACTIVITY_LENGTH = 4
 
+# How far away from its attacker a fleeing monster heads.
+FLEE_DISTANCE = 8
+
 
 class BaseMetadata(object):
     def __init__(self):
         self.active_turns = 0
+        # Route to wherever the monster is heading, if not the player.
+        self.path = pathing.CachedPath()
 
     def update_knowledge(self):
         pass
 
+    def is_dormant(self):
+        """
+        True if the monster does nothing this turn unless it spots the player.
+        """
+        return self.active_turns == 0
+
 
 def _spotting(monster_obj, metadata):
     if libtcod.map_is_in_fov(monster_obj.current_map.fov_map,
@@ -37,17 +51,43 @@ def _spotting(monster_obj, metadata):
         metadata.update_knowledge()
 
 
+def _flee_goal(monster, metadata):
+    """
+    Keep heading for the same spot FLEE_DISTANCE away from the attacker
+    until we get there or the attacker is closer to it than we are.
+    """
+    goal = metadata.flee_goal
+    if (goal is None or goal == monster.pos or
+            metadata.target.pos.distance(goal) <= monster.pos.distance(goal)):
+        away = algebra.Direction(monster.x - metadata.target.x,
+                                 monster.y - metadata.target.y)
+        away.normalize()
+        goal = algebra.Location(monster.x + away.x * FLEE_DISTANCE,
+                                monster.y + away.y * FLEE_DISTANCE)
+        goal.bound(monster.current_map.loc_bound)
+        metadata.flee_goal = goal
+    return goal
+
+
 def fleeing_monster(monster, player, metadata):
     # uses hostile_monster_metadata
     _spotting(monster, metadata)
 
     if metadata.active_turns > 0:
         metadata.active_turns -= 1
-        # No intelligent behavior at all here
-        actions.move_away_from(monster, metadata.target.pos)
+        step = pathing.path_step(monster, _flee_goal(monster, metadata),
+                                 metadata.path)
+        if step is None or not actions.move(monster, step):
+            actions.move_away_from(monster, metadata.target.pos)
         return
 
     # if we escape, stop fleeing and quiesce
+    _calm_down(monster, metadata)
+
+
+def _calm_down(monster, metadata):
+    metadata.flee_goal = None
+    metadata.path.clear()
     monster.ai = monster.old_ai
     monster.ai._metadata.active_turns = 0
     monster.fighter.last_attacker = None
@@ -89,6 +129,7 @@ class hostile_monster_metadata(BaseMetadata):
         super(hostile_monster_metadata, self).__init__()
         self.target = target
         self.last_seen_pos = None
+        self.flee_goal = None
 
     def update_knowledge(self):
         self.last_seen_pos = self.target.pos
@@ -103,7 +144,14 @@ def hostile_monster(monster, player, metadata):
     if metadata.active_turns > 0:
         metadata.active_turns -= 1
         if monster.pos.distance(metadata.last_seen_pos) >= 2:
-            actions.move_towards(monster, metadata.last_seen_pos)
+            step = None
+            if (metadata.target is player and
+                    metadata.last_seen_pos == player.pos):
+                step = pathing.flow_step(monster, player)
+            if step is not None:
+                actions.move(monster, step)
+            else:
+                actions.move_towards(monster, metadata.last_seen_pos)
         elif (monster.pos.distance(metadata.target.pos) < 2 and
               metadata.target.fighter.hp > 0):
             if not monster.current_map.is_blocked_from(monster.pos, metadata.target.pos,
@@ -167,6 +215,11 @@ def territorial_monster(monster, player, metadata):
                             hostile_monster_metadata(player))
             monster.ai.set_owner(monster)
             return monster.ai.take_turn(player)
+        if monster.pos.distance(metadata.home) >= metadata.radius:
+            # Knocked or confused out of its territory: head straight home.
+            step = pathing.path_step(monster, metadata.home, metadata.path)
+            if step is not None and actions.move(monster, step):
+                return
         while True:
             trial_dir = actions.random_direction()
             candidate = monster.pos + trial_dir
@@ -184,6 +237,9 @@ class confused_monster_metadata(BaseMetadata):
         self.old_ai = old_ai
         self.num_turns = num_turns
 
+    def is_dormant(self):
+        return False
+
 def confused_monster(monster, player, metadata):
     if metadata.num_turns > 0:
         actions.move(monster, actions.random_direction())
@@ -196,6 +252,57 @@ def confused_monster(monster, player, metadata):
                     ' is no longer confused!', libtcod.red)
 
 
+def _wander(monster, center, radius, tries=10):
+    """
+    Move (monster) to a random free tile within (radius) of (center),
+    at most one step up or down from where it is, if one turns up.
+    """
+    current_map = monster.current_map
+    elevation = current_map.elevation(monster.x, monster.y)
+    for i in range(tries):
+        pos = algebra.Location(center.x + libtcod.random_get_int(0, -radius, radius),
+                               center.y + libtcod.random_get_int(0, -radius, radius))
+        if (current_map.loc_bound.contains(pos) and
+                pos.distance(center) <= radius and
+                abs(current_map.elevation(pos.x, pos.y) - elevation) <= 1 and
+                not current_map.is_blocked_at(pos)):
+            current_map.move_object(monster, pos)
+            return
+
+
+def pass_time(monster, turns):
+    """
+    Coarsely advance (monster) by (turns) turns spent away from the player,
+    all at once: it stays active as long as it would have, tiring as it
+    goes, then calms down. Territorial and ignoring monsters that were
+    active end up somewhere else nearby.
+    """
+    metadata = monster.ai._metadata
+    if isinstance(metadata, confused_monster_metadata):
+        confused = min(metadata.num_turns, turns)
+        _wander(monster, monster.pos, int(math.sqrt(confused)))
+        metadata.num_turns -= confused
+        if metadata.num_turns > 0:
+            return
+        monster.ai = metadata.old_ai
+        metadata = monster.ai._metadata
+        turns -= confused
+    if metadata is None:
+        return
+
+    active = min(metadata.active_turns, turns)
+    metadata.active_turns -= active
+    monster.fighter.exhaustion += active * actions.MOVE_EXHAUSTION
+    function = monster.ai._turn_function
+    if function is territorial_monster and active > 0:
+        _wander(monster, metadata.home, metadata.radius)
+    elif function is ignoring_monster and active > 0:
+        # The spread of a random walk.
+        _wander(monster, monster.pos, int(math.sqrt(active)))
+    elif function is fleeing_monster and turns > active:
+        _calm_down(monster, metadata)
+
+
 def monster_death(monster):
     # Transform it into a nasty corpse! it doesn't block, can't be
     # attacked, and doesn't move.
@@ -215,7 +322,8 @@ def monster_death(monster):
             actions.drop(monster, monster.inventory[0], report=False, drop_all=True)
 
     monster.name = 'remains of ' + monster.name
-    monster.current_map.objects.remove(monster)
-    monster.current_map.objects.insert(0, monster)
+    monster.current_map.remove_object(monster)
+    monster.current_map.add_object(monster)
+    monster.current_map.tile_changed(monster.pos.x, monster.pos.y)
 
 
@@ -0,0 +1,655 @@
+"""
+Reproducible timings for performance-sensitive code paths.
+
+Run directly: python benchmark.py [results.json]
+Runs the suite with libtcod's random number generator reseeded to
+FIXED_SEED before every measurement, and writes the results as JSON
+(by default to benchmark.json) so runs can be compared.
+    python benchmark.py --fov
+compares the per-cell and bulk ways of building FOV maps.
+    python benchmark.py --draw
+compares the original per-cell redraw of the outdoor map with the
+map layer the renderer keeps.
+    python benchmark.py --menus [count]
+opens thousands of menus and log displays, checking that their
+consoles are reused and memory use stays flat.
+    python benchmark.py --chase [count]
+times turns with (count) monsters chasing, fleeing or heading home,
+with and without their cached paths.
+
+Requires the libtcod shared library, but not a window.
+Allocation figures need the tracemalloc module (standard in Python 3,
+available for Python 2 as pytracemalloc); without it they're null.
+"""
+# Copyright 2016 Thomas C. Hudson
+# Governed by the license described in LICENSE.txt
+import gc
+import json
+import numpy
+import platform
+import sys
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import libtcodpy as libtcod
+
+import config
+import algebra
+import ai
+import bestiary
+import events
+import interface
+import log
+import map
+import pathing
+import renderer
+import roguelike
+import ca_cartographer
+import dungeon_cartographer
+import mine_cartographer
+import mountain_cartographer
+
+FIXED_SEED = 1234
+RESULTS_FILE = 'benchmark.json'
+
+
+def _seed(seed=FIXED_SEED):
+    """
+    Reset libtcod's default generator, which also seeds every new map's.
+    """
+    rng = libtcod.random_new_from_seed(seed)
+    libtcod.random_restore(0, rng)
+    libtcod.random_delete(rng)
+
+
+def _max_rss_kb():
+    if resource is None:
+        return None
+    # Kilobytes on Linux, bytes on OS X.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss
+
+
+def _measure(name, setup, repeat):
+    """
+    Calls (setup)() and times the function it returns, (repeat) times,
+    reseeding before each setup; then makes one more run to count memory.
+    Returns a dict of results.
+    """
+    times = []
+    for i in range(repeat):
+        _seed()
+        function = setup()
+        start = time.time()
+        function()
+        times.append((time.time() - start) * 1000)
+
+    _seed()
+    function = setup()
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    net_bytes = None
+    peak_bytes = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        function()
+        (net_bytes, peak_bytes) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        function()
+    gc.collect()
+
+    result = {
+        'name': name,
+        'runs': repeat,
+        'best_ms': min(times),
+        'mean_ms': sum(times) / len(times),
+        'net_alloc_bytes': net_bytes,
+        'peak_alloc_bytes': peak_bytes,
+        'new_objects': len(gc.get_objects()) - objects_before,
+        'max_rss_kb': _max_rss_kb()
+    }
+    print('%-36s %9.2f ms' % (name, result['best_ms']))
+    return result
+
+
+def _new_player():
+    """
+    Returns the player of a new game, standing on the mountain.
+    """
+    _seed()
+    # One key to dismiss the welcome screen.
+    events.set_script([events.key(' ')])
+    player = roguelike.new_game()
+    events.set_script(None)
+    return player
+
+
+def _enter(player, new_map, pos):
+    """
+    Put the player back on (new_map) at (pos), with up-to-date FOV.
+    """
+    player.current_map = new_map
+    player.pos = algebra.Location(pos.x, pos.y)
+    player.game_state = 'playing'
+    renderer.update_camera(player)
+    roguelike.update_fov(player)
+
+
+def _snapshot(player):
+    """
+    Returns a copy of the player's map, pickled the way save_game() does,
+    for _restore() to rebuild.
+    """
+    current_map = player.current_map
+    return (pickle.dumps(current_map, 2), current_map.objects.index(player))
+
+
+def _restore(snapshot):
+    """
+    Returns the player of a fresh copy of a _snapshot(), ready to play,
+    so that every run of a benchmark starts from the same world.
+    """
+    (data, index) = snapshot
+    current_map = pickle.loads(data)
+    player = current_map.objects[index]
+    current_map.initialize_fov()
+    _enter(player, current_map, player.pos)
+    return player
+
+
+def run_suite(repeat=3, turns=20):
+    """
+    Returns a list of result dicts, one per benchmark.
+    Every setup starts from its own copy of the same new game,
+    so nothing one run does to the world carries into the next.
+    """
+    renderer.renderer_init(headless=True)
+    results = []
+
+    snapshot = _snapshot(_new_player())
+
+    def mountain():
+        player = _restore(snapshot)
+        return lambda: mountain_cartographer.make_map(player, 1)
+    results.append(_measure('mountain_cartographer.make_map', mountain, repeat))
+
+    def ca():
+        player = _restore(snapshot)
+        return lambda: ca_cartographer.make_map(player, 2)
+    results.append(_measure('ca_cartographer.make_map', ca, repeat))
+
+    def mine():
+        player = _restore(snapshot)
+        world = player.current_map
+        _enter(player, world, world.quarry_stairs[1].pos)
+        return lambda: mine_cartographer.make_map(player, 2)
+    results.append(_measure('mine_cartographer.make_map', mine, repeat))
+
+    def final():
+        player = _restore(snapshot)
+        world = player.current_map
+        _enter(player, world, world.dungeon_stairs[1].pos)
+        return lambda: dungeon_cartographer.make_final_map(player, 2)
+    results.append(_measure('dungeon_cartographer.make_final_map', final, repeat))
+
+    def initialize_fov():
+        world = _restore(snapshot).current_map
+        return lambda: world.initialize_fov()
+    results.append(_measure('initialize_fov', initialize_fov, repeat))
+
+    def cold_elevation():
+        player = _restore(snapshot)
+        player.current_map.initialize_fov()
+        return lambda: player.current_map.set_fov_elevation(player)
+    results.append(_measure('set_fov_elevation, cold', cold_elevation, repeat))
+
+    def cached_elevation():
+        player = _restore(snapshot)
+        player.current_map.set_fov_elevation(player)
+        return lambda: player.current_map.set_fov_elevation(player)
+    results.append(_measure('set_fov_elevation, cached', cached_elevation, repeat))
+
+    def draw_outdoors_new_map():
+        player = _restore(snapshot)
+        renderer.clear_console()
+        renderer._baked_map = None
+        return lambda: renderer._draw_map(player)
+    results.append(_measure('renderer._draw_map outdoors, new map',
+                            draw_outdoors_new_map, repeat))
+
+    def draw_outdoors_new_layer():
+        player = _restore(snapshot)
+        renderer._draw_map(player)
+        renderer.clear_console()
+        return lambda: renderer._draw_map(player)
+    results.append(_measure('renderer._draw_map outdoors, new layer',
+                            draw_outdoors_new_layer, repeat))
+
+    def draw_outdoors():
+        player = _restore(snapshot)
+        renderer._draw_map(player)
+        return lambda: renderer._draw_map(player)
+    results.append(_measure('renderer._draw_map outdoors', draw_outdoors, repeat))
+
+    def draw_indoors():
+        player = _restore(snapshot)
+        world = player.current_map
+        _enter(player, world, world.dungeon_stairs[1].pos)
+        dungeon_cartographer.make_final_map(player, 2)
+        _enter(player, player.current_map, player.pos)
+        renderer.clear_console()
+        renderer._draw_map(player)
+        return lambda: renderer._draw_map(player)
+    results.append(_measure('renderer._draw_map indoors', draw_indoors, repeat))
+
+    def ai_turns():
+        player = _restore(snapshot)
+        wait = events.key('.')
+        def play():
+            for i in range(turns):
+                roguelike.play_turn(player, wait)
+        return play
+    results.append(_measure(str(turns) + ' turns outdoors', ai_turns, repeat))
+
+    return results
+
+
+def _outdoor_map():
+    new_map = map.OutdoorMap(config.OUTDOOR_MAP_WIDTH, config.OUTDOOR_MAP_HEIGHT, 1)
+    new_map.random_seed = FIXED_SEED
+    mountain_cartographer._build_map(new_map)
+    return new_map
+
+
+def _per_cell_initialize_fov(current_map):
+    """
+    The original one-ctypes-call-per-tile BaseMap.initialize_fov().
+    """
+    current_map.fov_map = libtcod.map_new(current_map.width, current_map.height)
+    for y in range(current_map.height):
+        for x in range(current_map.width):
+            libtcod.map_set_properties(
+                current_map.fov_map, x, y,
+                not map.terrain_types[current_map.terrain[x, y]].blocks_sight,
+                not map.terrain_types[current_map.terrain[x, y]].blocks)
+    for obj in current_map.objects:
+        if obj.blocks_sight or obj.blocks:
+            t = map.terrain_types[current_map.terrain[obj.pos.x, obj.pos.y]]
+            libtcod.map_set_properties(current_map.fov_map, obj.pos.x, obj.pos.y,
+                                       not (obj.blocks_sight or t.blocks_sight),
+                                       not (obj.blocks or t.blocks))
+
+
+def _per_cell_fov_elevation(current_map, elevation):
+    """
+    The original per-tile loop from OutdoorMap.set_fov_elevation().
+    """
+    for y in range(current_map.height):
+        for x in range(current_map.width):
+            t = map.terrain_types[current_map.terrain[x, y]]
+            blocks_sight = (t.blocks_sight or
+                            current_map.region_elevations[current_map.region[x, y]] > elevation + 1)
+            libtcod.map_set_properties(current_map.fov_map, x, y, not blocks_sight, not t.blocks)
+
+
+def _bulk_fov_elevation(current_map, elevation):
+    (transparent, walkable) = current_map.fov_masks(elevation)
+    map.push_fov_masks(current_map.fov_map, transparent, walkable)
+
+
+def _time(label, function, repeat=5):
+    """
+    Prints and returns the best of (repeat) wall-clock times, in milliseconds.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = (time.time() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    print('%-36s %9.2f ms' % (label, best))
+    return best
+
+
+def _assert_same_fov_map(map_a, map_b, width, height):
+    for x in range(width):
+        for y in range(height):
+            assert (libtcod.map_is_transparent(map_a, x, y) ==
+                    libtcod.map_is_transparent(map_b, x, y))
+            assert (libtcod.map_is_walkable(map_a, x, y) ==
+                    libtcod.map_is_walkable(map_b, x, y))
+
+
+def benchmark_fov_construction():
+    """
+    Compare the per-cell and bulk paths for building the FOV map,
+    after checking that they produce the same map.
+    """
+    current_map = _outdoor_map()
+
+    _per_cell_initialize_fov(current_map)
+    reference = current_map.fov_map
+    current_map.fov_map = None
+    current_map.initialize_fov()
+    _assert_same_fov_map(reference, current_map.fov_map,
+                         current_map.width, current_map.height)
+    libtcod.map_delete(reference)
+
+    _time('initialize_fov, per cell',
+          lambda: _per_cell_initialize_fov(current_map))
+    _time('initialize_fov, bulk',
+          lambda: current_map.initialize_fov())
+    for elevation in (0, 4, 9):
+        _time('set_fov_elevation(' + str(elevation) + '), per cell',
+              lambda: _per_cell_fov_elevation(current_map, elevation))
+        _time('set_fov_elevation(' + str(elevation) + '), bulk',
+              lambda: _bulk_fov_elevation(current_map, elevation))
+        _time('set_fov_elevation(' + str(elevation) + '), cached layer',
+              lambda: libtcod.map_copy(current_map._fov_layer(elevation),
+                                       current_map.fov_map))
+
+
+def _per_cell_unseen(con, current_map, screen_x, screen_y, x, y, terrain, icon):
+    sc = terrain.unseen_color
+    if not sc:
+        sc = map.region_colors_unseen[current_map.tile_region_terrain[x, y]]
+    libtcod.console_set_char_background(con, screen_x, screen_y, sc, libtcod.BKGND_SET)
+    if icon:
+        libtcod.console_set_char_foreground(con, screen_x, screen_y, terrain.icon_color)
+        libtcod.console_set_char(con, screen_x, screen_y, icon)
+
+
+def _per_cell_outdoor_tile(con, current_map, player_elevation, screen_x, screen_y, x, y, visible):
+    """
+    The original per-tile drawing rules of the outdoor map.
+    """
+    terrain = map.terrain_types[current_map.terrain[x, y]]
+    explored = current_map._explored[x, y]
+    current_elevation = current_map.tile_elevation[x, y]
+    icon = terrain.icon
+    if icon:
+        if terrain.name == 'slope' and current_elevation < player_elevation:
+            icon = 'v'
+    if (current_elevation + 1 < player_elevation):
+        if visible or explored:
+            libtcod.console_put_char_ex(con, screen_x, screen_y, '#',
+                map.region_colors_seen[current_map.tile_region_terrain[x, y]],
+                libtcod.black)
+        if visible:
+            current_map._explored[x, y] = True
+    elif not visible:
+        if explored:
+            _per_cell_unseen(con, current_map, screen_x, screen_y, x, y, terrain, icon)
+    else:
+        seen_color = terrain.seen_color
+        if not seen_color:
+            seen_color = map.region_colors_seen[current_map.tile_region_terrain[x, y]]
+        libtcod.console_put_char_ex(con, screen_x, screen_y, icon, terrain.icon_color, seen_color)
+        current_map._explored[x, y] = True
+
+
+def _per_cell_draw_outdoors(player, visible):
+    """
+    The original redraw of the outdoor map, one ctypes call or two per tile.
+    """
+    libtcod.console_clear(renderer._con)
+    current_map = player.current_map
+    camera = player.camera_position
+    player_elevation = current_map.tile_elevation[player.pos.x, player.pos.y]
+    (width, height) = renderer._view_size(current_map)
+    for screen_y in range(height):
+        y = camera.y + screen_y
+        for screen_x in range(width):
+            x = camera.x + screen_x
+            _per_cell_outdoor_tile(renderer._con, current_map, player_elevation,
+                                   screen_x, screen_y, x, y, (x, y) in visible)
+
+
+def _console_contents(con):
+    """
+    Returns a list of (char, foreground, background) for every cell of (con);
+    the foreground of blank cells can't be seen, so is left out.
+    """
+    cells = []
+    for y in range(config.MAP_PANEL_HEIGHT):
+        for x in range(config.MAP_PANEL_WIDTH):
+            char = libtcod.console_get_char(con, x, y)
+            back = libtcod.console_get_char_background(con, x, y)
+            fore = None
+            if char != ord(' '):
+                fore = libtcod.console_get_char_foreground(con, x, y)
+                fore = (fore.r, fore.g, fore.b)
+            cells.append((char, fore, (back.r, back.g, back.b)))
+    return cells
+
+
+def _redraw_layer(player, rebake=False):
+    renderer.clear_console()
+    if rebake:
+        renderer._baked_map = None
+    renderer._draw_map(player)
+
+
+def benchmark_draw():
+    """
+    Compare the original per-cell redraw of the outdoor map with
+    renderer._draw_map(), after checking that they draw the same thing,
+    at a few places and elevations with half the map already explored.
+    The map layer is checked both freshly built and after incremental
+    updates for newly explored tiles and changed terrain; the latter
+    also rebakes the cached layers for each elevation.
+    """
+    renderer.renderer_init(headless=True)
+    player = _new_player()
+    world = player.current_map
+    random = numpy.random.RandomState(FIXED_SEED)
+    explored = random.rand(world.width, world.height) < 0.5
+    for pos in (player.pos, world.quarry_stairs[1].pos, world.dungeon_stairs[1].pos):
+        _enter(player, world, pos)
+        visible = renderer.visible_tiles(player)
+
+        world._explored = explored.copy()
+        _per_cell_draw_outdoors(player, visible)
+        reference = _console_contents(renderer._con)
+        reference_explored = world._explored
+
+        world._explored = explored.copy()
+        _redraw_layer(player)
+        assert _console_contents(renderer._con) == reference
+        assert (world._explored == reference_explored).all()
+
+        world._explored |= random.rand(world.width, world.height) < 0.05
+        changed = algebra.Location(pos.x + 5, pos.y)
+        original_terrain = world.terrain_index_at(changed)
+        world.set_terrain(changed, 4)
+        renderer._draw_map(player)
+        drawn = _console_contents(renderer._con)
+        _per_cell_draw_outdoors(player, visible)
+        assert drawn == _console_contents(renderer._con)
+        world.set_terrain(changed, original_terrain)
+
+        elevation = str(world.elevation(pos.x, pos.y))
+        _time('draw at elevation ' + elevation + ', per cell',
+              lambda: _per_cell_draw_outdoors(player, visible))
+        _time('draw at elevation ' + elevation + ', new bake',
+              lambda: _redraw_layer(player, rebake=True))
+        _time('draw at elevation ' + elevation + ', new layer',
+              lambda: _redraw_layer(player))
+        _time('draw at elevation ' + elevation + ', layer',
+              lambda: renderer._draw_map(player))
+
+
+def _open_menus(count):
+    events.set_script([events.key('a'), events.key('x')] * count)
+    for i in range(count):
+        renderer.menu('Choose one of these at random.', ['this', 'that'], 30)
+        interface.log_display()
+    events.set_script(None)
+
+
+def stress_menus(count=5000):
+    """
+    Open (count) menus and log displays without a window, then check
+    that only one console per window size was ever kept and that peak
+    memory didn't grow once the first few had been opened.
+    """
+    renderer.renderer_init(headless=True)
+    log.init()
+    for i in range(60):
+        log.message('Line ' + str(i) + ' of the log.')
+    _open_menus(100)
+    rss_before = _max_rss_kb()
+    start = time.time()
+    _open_menus(count)
+    elapsed = (time.time() - start) * 1000
+    rss_after = _max_rss_kb()
+    print('%d menus and log displays in %.0f ms' % (count, elapsed))
+    print('pooled consoles: %d' % renderer.pooled_console_count())
+    if rss_before is not None:
+        print('peak RSS %d kB before, %d kB after' % (rss_before, rss_after))
+    assert renderer.pooled_console_count() == 2
+    renderer.renderer_shutdown()
+    assert renderer.pooled_console_count() == 0
+
+
+def _spawn_crowd(player, count, make):
+    """
+    Put (count) monsters built by (make)(map, pos, player) on free tiles
+    5 to 15 steps from the player; returns them.
+    """
+    current_map = player.current_map
+    crowd = []
+    while len(crowd) < count:
+        pos = algebra.Location(player.pos.x + libtcod.random_get_int(0, -15, 15),
+                               player.pos.y + libtcod.random_get_int(0, -15, 15))
+        if (current_map.loc_bound.contains(pos) and
+                player.pos.distance(pos) >= 5 and
+                not current_map.is_blocked_at(pos)):
+            crowd.append(make(current_map, pos, player))
+    return crowd
+
+
+def _chaser(current_map, pos, player):
+    monster = bestiary.wolf(current_map, pos, player)
+    monster.ai._metadata.last_seen_pos = player.pos
+    return monster
+
+
+def _fleer(current_map, pos, player):
+    monster = bestiary.deer(current_map, pos, player)
+    monster.old_ai = monster.ai
+    monster.ai = ai.AI(ai.fleeing_monster, ai.hostile_monster_metadata(player))
+    monster.ai.set_owner(monster)
+    return monster
+
+
+def _homebody(current_map, pos, player):
+    """
+    A territorial monster whose home is as far again from the player.
+    """
+    monster = bestiary._territorial_monster(current_map, pos, player, 'U', 'bear',
+                                            libtcod.darker_orange)
+    home = algebra.Location(2 * pos.x - player.pos.x, 2 * pos.y - player.pos.y)
+    home.bound(current_map.loc_bound)
+    monster.ai._metadata.home = home
+    return monster
+
+
+def benchmark_chase(count=40, turns=20, repeat=3):
+    """
+    Time (turns) turns on the mountain with (count) monsters that all act
+    every turn: chasing the player, fleeing it, or walking home away from it.
+    Fleeing and homeward runs are repeated with every cached path
+    discarded each turn, as if A* were run on demand.
+    """
+    renderer.renderer_init(headless=True)
+    player = _new_player()
+    world = player.current_map
+    start_pos = player.pos
+    player.fighter.max_hp = player.fighter.hp = 1000000
+    wait = events.key('.')
+    crowd = []
+
+    def setup(make, recompute):
+        for monster in crowd:
+            if monster.current_map is world and monster in world.objects:
+                world.remove_object(monster)
+        _enter(player, world, start_pos)
+        crowd[:] = _spawn_crowd(player, count, make)
+        def play():
+            for i in range(turns):
+                for monster in crowd:
+                    if monster.ai:
+                        monster.ai._metadata.active_turns = ai.ACTIVITY_LENGTH
+                        world.wake(monster)
+                        if recompute:
+                            monster.ai._metadata.path.clear()
+                roguelike.play_turn(player, wait)
+        return play
+
+    for (label, make) in (('chasing', _chaser),
+                          ('fleeing', _fleer),
+                          ('heading home', _homebody)):
+        for recompute in (False, True):
+            if make is _chaser and recompute:
+                continue
+            name = '%d turns, %d %s%s' % (turns, count, label,
+                                          ', uncached' if recompute else '')
+            _measure(name, lambda: setup(make, recompute), repeat)
+            before = pathing.path_computations
+            setup(make, recompute)()
+            print('%36s %9d A* searches' % ('', pathing.path_computations - before))
+    renderer.renderer_shutdown()
+
+
+def write_results(results, path):
+    report = {
+        'seed': FIXED_SEED,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'tracemalloc': tracemalloc is not None,
+        'results': results
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--fov':
+        benchmark_fov_construction()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--draw':
+        benchmark_draw()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--menus':
+        if len(sys.argv) > 2:
+            stress_menus(int(sys.argv[2]))
+        else:
+            stress_menus()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--chase':
+        if len(sys.argv) > 2:
+            benchmark_chase(int(sys.argv[2]))
+        else:
+            benchmark_chase()
+    else:
+        path = RESULTS_FILE
+        if len(sys.argv) > 1:
+            path = sys.argv[1]
+        write_results(run_suite(), path)
+        print('Results written to ' + path)
@@ -11,7 +11,7 @@ import miscellany
 
 
 def _insert(creature, new_map):
-    new_map.objects.append(creature)
+    new_map.add_object(creature, at_end=True)
     creature.current_map = new_map
 
 
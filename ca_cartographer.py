@@ -1,9 +1,9 @@
 # Copyright 2016 Thomas C. Hudson
 # Governed by the license described in LICENSE.txt
-import copy
 import cProfile
 
 import libtcodpy as libtcod
+import numpy
 
 import config
 import algebra
@@ -80,7 +80,7 @@ def _inhabit_pool(new_map):
     pos = algebra.Location(new_map.pool_x, new_map.height / 2)
     nymph = Object(pos, '@', 'nymph', libtcod.azure, blocks=True,
         interactable=Interactable(use_function=quest.nymph_info))
-    new_map.objects.append(nymph)
+    new_map.add_object(nymph, at_end=True)
 
 
 def _check_for_openness(new_map, x, y):
@@ -234,7 +234,7 @@ def dig_ca_region(new_map, rect, gen1_count, gen2_count):
 def _build_map(new_map):
     new_map.rng = libtcod.random_new_from_seed(new_map.random_seed)
 
-    new_map.spare_terrain = copy.deepcopy(new_map.terrain) # [[0 for y in range(new_map.height)] for x in range(new_map.width)]
+    new_map.spare_terrain = new_map.terrain.copy()
     dig_ca_region(new_map, algebra.Rect(0, 0, new_map.width, new_map.height), 4, 3)
 
     center = algebra.Location(new_map.width / 2, new_map.height / 2)
@@ -245,7 +245,7 @@ def _build_map(new_map):
         # Uh-oh; no guarantee of completion
         print('Recursing with unenterable map:')
         # _dump(new_map)
-        new_map.random_seed = libtcod.random_save(new_map.rng)
+        new_map.random_seed = libtcod.random_get_int(new_map.rng, 0, 0x7FFFFFFF)
         return _build_map(new_map)
 
     pool_x = new_map.width / 4
@@ -267,16 +267,14 @@ def _build_map(new_map):
          # Uh-oh; no guarantee of completion
         print('Recursing with disconnected map:')
         # _dump(new_map)
-        new_map.random_seed = libtcod.random_save(new_map.rng)
+        new_map.random_seed = libtcod.random_get_int(new_map.rng, 0, 0x7FFFFFFF)
         return _build_map(new_map)
 
     # Close up any unconnected subcaves; flood any western bits
-    for x in range(1, new_map.width-1):
-        for y in range(1, new_map.height-1):
-            if new_map.terrain[x][y] == map.TERRAIN_GROUND:
-                new_map.terrain[x][y] = map.TERRAIN_WALL
-            elif x < pool_x and new_map.terrain[x][y] == map.TERRAIN_FLOOR:
-                new_map.terrain[x][y] = map.TERRAIN_WATER
+    interior = new_map.terrain[1:new_map.width-1, 1:new_map.height-1]
+    interior[interior == map.TERRAIN_GROUND] = map.TERRAIN_WALL
+    western = new_map.terrain[1:pool_x, 1:new_map.height-1]
+    western[western == map.TERRAIN_FLOOR] = map.TERRAIN_WATER
 
     #for x in range(0, new_map.width):
     #    new_map.terrain[x][0] = map.TERRAIN_WALL
@@ -298,7 +296,7 @@ def make_map(player, dungeon_level):
     new_map.objects.append(player)
     player.current_map = new_map
     player.camera_position = algebra.Location(0, 0)
-    new_map.random_seed = libtcod.random_save(0)
+    new_map.random_seed = map.new_seed()
     player.pos = _build_map(new_map)
 
     _inhabit_pool(new_map)
@@ -341,14 +339,14 @@ def _test_map_repeatability():
     same corridors and rooms.
     """
     map1 = map.DungeonMap(config.MAP_WIDTH, config.MAP_HEIGHT, 3)
-    map1.random_seed = libtcod.random_save(0)
+    map1.random_seed = map.new_seed()
     _build_map(map1)
 
     map2 = map.DungeonMap(config.MAP_WIDTH, config.MAP_HEIGHT, 3)
     map2.random_seed = map1.random_seed
     _build_map(map2)
 
-    assert map1.terrain == map2.terrain
+    assert numpy.array_equal(map1.terrain, map2.terrain)
 
 
 if __name__ == '__main__':
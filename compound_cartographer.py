@@ -77,7 +77,7 @@ def _add_loot(new_map, function, count):
     else:
         loot = function()
     loot.pos = pos
-    new_map.objects.insert(0, loot)
+    new_map.add_object(loot)
 
 
 def inhabit_caravanserai(new_map, player):
@@ -149,7 +149,7 @@ def _place_caravanserai(new_map, size):
 def _place_door(new_map, pos):
     new_map.terrain[pos.x][pos.y] = map.TERRAIN_FLOOR
     door_obj = miscellany.closed_door(pos)
-    new_map.objects.insert(0, door_obj)
+    new_map.add_object(door_obj)
 
 
 def _clear_outside_walls(new_map, bounds):
@@ -31,3 +31,11 @@ ELEVATION_EXPLORATION_SP = 5
 FOV_ALGO = 0
 FOV_LIGHT_WALLS = True
 TORCH_RADIUS = 10
+
+# Hostile monsters within this many tiles of the player
+# follow the shared flow field towards them.
+AI_FLOW_RADIUS = 20
+
+# If set, every log message is also appended to this file,
+# beyond the lines kept for the history display.
+LOG_HISTORY_FILE = None
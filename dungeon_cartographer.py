@@ -62,7 +62,7 @@ def _create_v_tunnel(new_map, y1, y2, x):
 def _place_door(new_map, pos):
     new_map.terrain[pos.x][pos.y] = map.TERRAIN_FLOOR
     door_obj = miscellany.closed_door(pos)
-    new_map.objects.insert(0, door_obj)
+    new_map.add_object(door_obj)
 
 
 def _check_door_configuration(new_map, pos, direction):
@@ -116,7 +116,7 @@ def make_final_map(player, dungeon_level):
     new_map.objects.append(player)
     player.current_map = new_map
     player.camera_position = algebra.Location(0, 0)
-    new_map.random_seed = libtcod.random_save(0)
+    new_map.random_seed = map.new_seed()
     new_map.rng = libtcod.random_new_from_seed(new_map.random_seed)
 
     entry_stairs = old_map.dungeon_stairs
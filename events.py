@@ -0,0 +1,125 @@
+"""
+The source of keyboard and mouse events for the whole game.
+
+events.check_for_event(mask, key, mouse) wraps libtcod.sys_check_for_event().
+events.wait_for_event(mask, key, mouse) wraps libtcod.sys_wait_for_event(),
+  sleeping until there's input instead of spinning.
+events.wait_for_key() blocks for a keypress, ignoring bare modifier keys.
+events.set_script(keys) substitutes a prepared sequence of libtcod.Key
+  for live input, so the game can run without a player at the keyboard;
+  set_script(None) restores live input.
+events.keys_from_string(text) builds a script from plain characters.
+"""
+# Copyright 2016 Thomas C. Hudson
+# Governed by the license described in LICENSE.txt
+import collections
+
+import libtcodpy as libtcod
+
+
+MODIFIER_KEYS = (libtcod.KEY_ALT, libtcod.KEY_SHIFT, libtcod.KEY_CONTROL)
+
+
+class ScriptExhausted(Exception):
+    """
+    Raised when input is requested after the last scripted event.
+    """
+    pass
+
+
+_script = None
+""" deque of libtcod.Key still to be delivered, or None for live input """
+
+
+def set_script(keys):
+    global _script
+    if keys is None:
+        _script = None
+    else:
+        _script = collections.deque(keys)
+
+
+def is_scripted():
+    return _script is not None
+
+
+def script_done():
+    return _script is not None and len(_script) == 0
+
+
+def key(c=0, vk=libtcod.KEY_CHAR, shift=False, ctrl=False):
+    """
+    Returns a libtcod.Key for a press of character (c),
+    or of special key (vk) if c is 0.
+    """
+    k = libtcod.Key()
+    if c:
+        k.c = ord(c)
+        k.vk = libtcod.KEY_CHAR
+    else:
+        k.vk = vk
+    k.pressed = True
+    k.shift = shift
+    k.lctrl = ctrl
+    return k
+
+
+def keys_from_string(text):
+    """
+    Returns one keypress per character of (text);
+    upper-case letters are sent with shift held.
+    """
+    return [key(c, shift=c.isupper()) for c in text]
+
+
+def _copy_key(source, dest):
+    for (field, ctype) in libtcod.Key._fields_:
+        setattr(dest, field, getattr(source, field))
+
+
+def check_for_event(mask, key, mouse):
+    """
+    As libtcod.sys_check_for_event(); when scripted, fills in (key)
+    from the next scripted keypress and leaves (mouse) untouched.
+    """
+    if _script is None:
+        return libtcod.sys_check_for_event(mask, key, mouse)
+    if not mask & libtcod.EVENT_KEY_PRESS:
+        return 0
+    if not _script:
+        raise ScriptExhausted()
+    _copy_key(_script.popleft(), key)
+    return libtcod.EVENT_KEY_PRESS
+
+
+def wait_for_event(mask, key, mouse):
+    """
+    As libtcod.sys_wait_for_event(), without flushing pending events.
+    When scripted, as check_for_event(), except that waiting for an event
+    the script can never supply raises ScriptExhausted.
+    """
+    if _script is None:
+        return libtcod.sys_wait_for_event(mask, key, mouse, False)
+    if not mask & libtcod.EVENT_KEY_PRESS:
+        raise ScriptExhausted()
+    return check_for_event(mask, key, mouse)
+
+
+def is_modifier(key):
+    return key.vk in MODIFIER_KEYS
+
+
+def wait_for_key():
+    """
+    Returns the libtcod.Key for the next keypress other than a bare
+    Alt, Shift or Control. Returns immediately, with no key, if the
+    window has been closed.
+    """
+    key = libtcod.Key()
+    mouse = libtcod.Mouse()
+    while True:
+        wait_for_event(libtcod.EVENT_KEY_PRESS, key, mouse)
+        if key.vk != libtcod.KEY_NONE and not is_modifier(key):
+            return key
+        if libtcod.console_is_window_closed():
+            return key
@@ -3,6 +3,7 @@ All functions that take input (other than the game mainloop).
 
 interface.poll() returns (libtcod.Key, libtcod.Mouse) with key *presses*
   and mouse events, but not key *releases*.
+interface.wait() is poll() that sleeps until there is such an event.
 interface.parse_move(key) translates a libtcod.Key into directional movement.
 interface.log_display(width=60)
 interface.target_tile(actor, max_range=None)
@@ -13,6 +14,7 @@ import libtcodpy as libtcod
 
 import config
 import algebra
+import events
 import log
 import renderer
 
@@ -20,8 +22,16 @@ import renderer
 def poll():
     key = libtcod.Key()
     mouse = libtcod.Mouse()
-    libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS |
-                                libtcod.EVENT_MOUSE, key, mouse)
+    events.check_for_event(libtcod.EVENT_KEY_PRESS |
+                           libtcod.EVENT_MOUSE, key, mouse)
+    return (key, mouse)
+
+
+def wait():
+    key = libtcod.Key()
+    mouse = libtcod.Mouse()
+    events.wait_for_event(libtcod.EVENT_KEY_PRESS |
+                          libtcod.EVENT_MOUSE, key, mouse)
     return (key, mouse)
 
 
@@ -70,8 +80,8 @@ def _colored_text_list(lines, width):
     """
     length = len(lines)
     height = min(length, 40)
-    window = libtcod.console_new(width, height)
     offset = -height
+    drawn_offset = None
 
     while True:
         if offset > -height:
@@ -79,17 +89,21 @@ def _colored_text_list(lines, width):
         if offset < -length:
             offset = -length
 
-        libtcod.console_clear(window)
-        renderer.write_log(lines[offset:length + offset + height],
-                           window, 0, 0)
+        # Scrolling past either end changes nothing, so needn't redraw.
+        if offset != drawn_offset:
+            window = renderer.borrow_console(width, height)
+            renderer.write_log(lines[offset:length + offset + height],
+                               window, 0, 0)
 
-        x = config.SCREEN_WIDTH/2 - width/2
-        y = config.SCREEN_HEIGHT/2 - height/2
-        libtcod.console_blit(window, 0, 0, width, height, 0, x, y, 1.0, 0.7)
+            x = config.SCREEN_WIDTH/2 - width/2
+            y = config.SCREEN_HEIGHT/2 - height/2
+            libtcod.console_blit(window, 0, 0, width, height, 0, x, y, 1.0, 0.7)
+            renderer.release_console(window)
 
-        libtcod.console_flush()
+            libtcod.console_flush()
+            drawn_offset = offset
         while True:
-            (key, mouse) = poll()
+            (key, mouse) = wait()
             (key_pressed, direction, shift) = parse_move(key)
             if key_pressed:
                 if direction == algebra.north and not shift:
@@ -112,11 +126,10 @@ def _colored_text_list(lines, width):
             elif mouse.wheel_down:
                 offset += height/2
                 break
-            elif (key.vk == libtcod.KEY_ALT or
-                  key.vk == libtcod.KEY_CONTROL or
-                  key.vk == libtcod.KEY_SHIFT or
-                  key.vk == libtcod.KEY_NONE):
-                break
+            elif events.is_modifier(key) or key.vk == libtcod.KEY_NONE:
+                if libtcod.console_is_window_closed():
+                    return
+                continue
             return
 
 
@@ -124,13 +137,36 @@ def log_display(width=60):
     """
     Display the recent log history, wait for any keypress.
     """
-    _colored_text_list(log.game_msgs, width)
+    _colored_text_list(list(log.game_msgs), width)
+
+
+def _line_cells((x0, y0), (x1, y1)):
+    """
+    Returns the set of screen cells on the line from (x0, y0) to (x1, y1),
+    not counting the start, up to the edge of the map panel.
+    """
+    cells = set()
+    libtcod.line_init(x0, y0, x1, y1)
+    nx, ny = libtcod.line_step()
+    while ((not (nx is None)) and nx >= 0 and ny >= 0 and
+           nx < config.MAP_PANEL_WIDTH and
+           ny < config.MAP_PANEL_HEIGHT):
+        cells.add((nx, ny))
+        nx, ny = libtcod.line_step()
+    return cells
+
+
+def _clear_targeting():
+    renderer.overlay_layer('targeting').clear()
 
 
 def target_tile(actor, max_range=None):
     """
     Return the position of a tile left-clicked in player's FOV
     (optionally in a range), or (None,None) if right-clicked.
+    The screen is only redrawn when the cursor moves to another cell,
+    and then only the overlay cells where the old and new lines of fire
+    differ are changed.
     """
     (key, mouse) = poll()
     (ox, oy) = (mouse.cx, mouse.cy)
@@ -138,15 +174,38 @@ def target_tile(actor, max_range=None):
     using_keyboard = False
     (kx, ky) = renderer.ScreenCoords.fromWorldCoords(actor.camera_position,
                                                      actor.pos)
+    # Neither the player nor the camera moves while aiming.
+    (ux, uy) = (kx, ky)
     pos = None
+    lines = {}
+    drawn_cursor = None
+    drawn_line = set()
+    layer = renderer.overlay_layer('targeting', order=10)
 
+    layer.clear()
     while True:
-        # Render the screen. This erases the inventory and shows
-        # the names of objects under the mouse.
-        libtcod.console_flush()
-        (key, mouse) = poll()
-        renderer.render_all(actor, (kx, ky))
-        actor.current_map.fov_needs_recompute = False
+        if (kx, ky) != drawn_cursor:
+            line = lines.get((kx, ky))
+            if line is None:
+                line = _line_cells((ux, uy), (kx, ky))
+                lines[(kx, ky)] = line
+            for (x, y) in drawn_line - line:
+                layer.clear_cell(x, y)
+            for (x, y) in line - drawn_line:
+                layer.set_cell(x, y, libtcod.lighter_crimson)
+            drawn_line = line
+            drawn_cursor = (kx, ky)
+
+            # Render the screen. This erases the inventory and shows
+            # the names of objects under the mouse.
+            renderer.render_all(actor, (kx, ky))
+            libtcod.console_flush()
+
+        # Sleep until the mouse moves or a key is pressed.
+        (key, mouse) = wait()
+        if libtcod.console_is_window_closed():
+            _clear_targeting()
+            return None
         if (mouse.cx != ox or mouse.cy != oy):
             using_mouse = True
             using_keyboard = False
@@ -163,21 +222,9 @@ def target_tile(actor, max_range=None):
         if using_mouse:
             (kx, ky) = (mouse.cx, mouse.cy)
         pos = renderer.ScreenCoords.toWorldCoords(actor.camera_position, (kx, ky))
-        libtcod.console_set_default_background(renderer._overlay, libtcod.black)
-        libtcod.console_clear(renderer._overlay)
-        (ux, uy) = renderer.ScreenCoords.fromWorldCoords(actor.camera_position,
-                                                         actor.pos)
-        libtcod.line_init(ux, uy, kx, ky)
-
-        nx, ny = libtcod.line_step()
-        while ((not (nx is None)) and nx >= 0 and ny >= 0 and
-               nx < config.MAP_PANEL_WIDTH and
-               ny < config.MAP_PANEL_HEIGHT):
-            libtcod.console_set_char_background(renderer._overlay, nx, ny, libtcod.lighter_crimson, libtcod.BKGND_SET)
-            nx, ny = libtcod.line_step()
 
         if mouse.rbutton_pressed or key.vk == libtcod.KEY_ESCAPE:
-            libtcod.console_clear(renderer._overlay)
+            _clear_targeting()
             return None
 
         # Accept the target if the player clicked in FOV
@@ -186,5 +233,5 @@ def target_tile(actor, max_range=None):
              key.vk == libtcod.KEY_KPENTER) and
                 libtcod.map_is_in_fov(actor.current_map.fov_map, pos.x, pos.y) and
                 (max_range is None or actor.distance(pos) <= max_range)):
-            libtcod.console_clear(renderer._overlay)
+            _clear_targeting()
             return pos
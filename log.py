@@ -2,12 +2,17 @@
 Global message log.
 
 Call log.init() before using.
-Retrieve (message, color) tuples from log.game_msgs[].
+Retrieve (message, color) tuples from log.game_msgs, a deque holding
+the last MSG_LIMIT lines, or the last few with log.recent().
 Append them using log.message().
+log.version changes whenever a message is added.
+If init() is given a history file, every line is also appended to it,
+so nothing is lost when old lines fall off game_msgs.
 """
 # Copyright 2016 Thomas C. Hudson
 # Governed by the license described in LICENSE.txt
 import libtcodpy as libtcod
+import collections
 import textwrap
 
 import config
@@ -17,6 +22,16 @@ MSG_WIDTH = config.SCREEN_WIDTH - config.BAR_WIDTH - 2
 MSG_HEIGHT = config.PANEL_HEIGHT - 1
 # Number of lines of messages retained for history display (^p)
 MSG_LIMIT = 150
+# Number of distinct messages whose wrapping is remembered
+WRAP_CACHE_LIMIT = 256
+
+version = 0
+game_msgs = collections.deque(maxlen=MSG_LIMIT)
+
+_wrapped = {}
+""" message text -> list of wrapped lines """
+_history = None
+""" file every line is appended to, or None """
 
 
 class ExplicitMessage(object):
@@ -31,11 +46,52 @@ class ExplicitMessage(object):
                 self.count + other.count < 10)
 
 
-def init():
-    global game_msgs
+def init(history_file=None):
+    """
+    Empty the log; if (history_file) is given, append every
+    line logged from now on to it.
+    """
+    global version, _history
+    game_msgs.clear()
+    version += 1
+    close()
+    if history_file is not None:
+        # Line buffered, so the history survives a crash.
+        _history = open(history_file, 'a', 1)
+
+
+def close():
+    global _history
+    if _history is not None:
+        _history.close()
+        _history = None
+
+
+def restore(messages):
+    """
+    Replace the log with (messages), e.g. from a saved game.
+    """
+    global game_msgs, version
+    game_msgs = collections.deque(messages, maxlen=MSG_LIMIT)
+    version += 1
+
+
+def recent(count):
+    """
+    Returns a list of the last (count) lines of the log, oldest first.
+    """
+    start = max(0, len(game_msgs) - count)
+    return [game_msgs[i] for i in range(start, len(game_msgs))]
 
-    # The list of game messages and their colors; starts empty.
-    game_msgs = []
+
+def _wrap(text):
+    lines = _wrapped.get(text)
+    if lines is None:
+        if len(_wrapped) >= WRAP_CACHE_LIMIT:
+            _wrapped.clear()
+        lines = textwrap.wrap(text, MSG_WIDTH-5)
+        _wrapped[text] = lines
+    return lines
 
 
 def message(new_msg, color=libtcod.white):
@@ -44,16 +100,14 @@ def message(new_msg, color=libtcod.white):
     does wordwrap at MSG_WIDTH-5 characters
     since a count e.g. " (x3)" can add up to 5.
     """
-    global game_msgs
-    new_msg_lines = textwrap.wrap(new_msg, MSG_WIDTH-5)
-
-    for line in new_msg_lines:
-        # If the buffer is full, remove the first line
-        # to make room for the new one.
-        if len(game_msgs) == MSG_LIMIT:
-            del game_msgs[0]
+    global version
+    version += 1
+    for line in _wrap(new_msg):
+        if _history is not None:
+            _history.write(line + '\n')
         new_message = ExplicitMessage(line, color, 1)
         if game_msgs and game_msgs[-1].can_merge(new_message):
             game_msgs[-1].count += 1
             return
+        # A full deque drops its first line to make room.
         game_msgs.append(new_message)
@@ -1,6 +1,8 @@
 # Copyright 2016 Thomas C. Hudson
 # Governed by the license described in LICENSE.txt
 import libtcodpy as libtcod
+import heapq
+import numpy
 
 import config
 import algebra
@@ -52,12 +54,61 @@ terrain_types = [
                 libtcod.Color(200, 180, 50), libtcod.Color(50, 50, 150), False, False)
             ]
 
+# Per-terrain property tables, indexed by terrain type like terrain_types,
+# so that whole-map masks can be built with a single numpy lookup.
+terrain_transparent = numpy.array([not t.blocks_sight for t in terrain_types])
+terrain_walkable = numpy.array([not t.blocks for t in terrain_types])
+
 TERRAIN_WALL = 0
 TERRAIN_GROUND = 1
 TERRAIN_SLOPE = 2
 TERRAIN_WATER = 3
 TERRAIN_FLOOR = 10
 
+# How many changed cells a cached elevation layer of an OutdoorMap may
+# accumulate before it is dropped instead of patched.
+MAX_STALE_FOV_CELLS = 2000
+
+def new_grid(width, height, fill, dtype):
+    """
+    Returns a (width x height) array for per-tile map data.
+    Indexed as grid[x][y], like the lists of lists it replaced,
+    but stored contiguously with a compact dtype so whole-map
+    operations can be vectorized and it pickles as a single buffer.
+    grid[x, y] is faster than grid[x][y] in hot loops.
+    """
+    return numpy.full((width, height), fill, dtype=dtype)
+
+
+def new_seed():
+    """
+    Returns a seed for a new map's random number generator, drawn from
+    libtcod's default generator so that seeding it reproduces a game.
+    """
+    return libtcod.random_get_int(0, 0, 0x7FFFFFFF)
+
+
+def push_fov_masks(fov_map, transparent, walkable):
+    """
+    Copy boolean (width x height) masks into a libtcod map.
+    One map_clear() sets every cell to the most common case, then only
+    the cells that differ from it need a map_set_properties() call.
+    """
+    # Only ever clear to all-open or all-closed: libtcodpy's map_clear()
+    # names its flags in the opposite order to the C library.
+    open_cells = transparent & walkable
+    default_open = open_cells.sum() * 2 >= open_cells.size
+    libtcod.map_clear(fov_map, default_open, default_open)
+    if default_open:
+        (xs, ys) = numpy.nonzero(~open_cells)
+    else:
+        (xs, ys) = numpy.nonzero(transparent | walkable)
+    for (x, y, t, w) in zip(xs.tolist(), ys.tolist(),
+                            transparent[xs, ys].tolist(),
+                            walkable[xs, ys].tolist()):
+        libtcod.map_set_properties(fov_map, x, y, t, w)
+
+
 region_colors_seen =  {
     'lake' : libtcod.dark_azure,
     'marsh' : libtcod.darker_chartreuse,
@@ -86,18 +137,40 @@ class BaseMap(object):
         self.height = height
         self.loc_bound = algebra.Rect(0, 0, width-1, height-1)
         self.objects = []
+        self._objects_at = {}
         self.portals = []
+        # Heap of (time, count, object) for the objects due to act,
+        # the count of each one's live entry, and when each last acted
+        # while on the timeline; see scheduler.py.
+        self.time = 0
+        self.timeline = []
+        self._scheduled = {}
+        self._timeline_count = 0
+        self.last_acted = {}
 
         self.random_seed = None
         self.rng = None
 
         self.fov_map = None
         self.fov_needs_recompute = True
-
-        self.terrain = [[default_terrain for y in range(height)] for x in range(width)]
-        self._explored = [[False for y in range(height)] for x in range(width)]
+        self.fov_generation = 0
+
+        self.terrain = new_grid(width, height, default_terrain, numpy.uint8)
+        self._explored = new_grid(width, height, False, numpy.bool_)
+        # Incremented whenever an object arrives on or leaves a tile,
+        # or its terrain changes during play.
+        self._tile_versions = new_grid(width, height, 0, numpy.uint32)
+        # (x, y) of tiles whose terrain or blocking objects changed since
+        # pathing last looked; None until it starts tracking them, or
+        # once everything has to be looked at again.
+        self.changed_cells = None
+        # Counts set_terrain() calls; _terrain_changes lists the tile each changed.
+        self.terrain_version = 0
+        self._terrain_changes = []
 
         self.xp_visit = None
+        # player.turn_count when the player last left this map, if ever.
+        self.left_turn = None
 
     def rnd(self, mi, ma):
         """
@@ -112,49 +185,264 @@ class BaseMap(object):
         Set up corresponding C state for libtcod.
         Must be called explicitly after loading from savegame or entering from
         another map.
+        Also rebuilds the object index, since cartographers place objects
+        directly into self.objects.
         """
+        self.reindex_objects()
         self.fov_needs_recompute = True
-        self.fov_map = libtcod.map_new(self.width, self.height)
-        for y in range(self.height):
-            for x in range(self.width):
-                libtcod.map_set_properties(
-                    self.fov_map, x, y,
-                    not terrain_types[self.terrain[x][y]].blocks_sight,
-                    not terrain_types[self.terrain[x][y]].blocks)
+        if self.fov_map is None:
+            self.fov_map = libtcod.map_new(self.width, self.height)
+        (transparent, walkable) = self.fov_masks()
+        push_fov_masks(self.fov_map, transparent, walkable)
+
+    def compute_fov(self, pos):
+        """
+        Compute FOV from (pos) out to the torch radius;
+        fov_generation counts recomputations, so anything drawn from FOV
+        can tell whether it's out of date.
+        """
+        libtcod.map_compute_fov(
+            self.fov_map, pos.x, pos.y,
+            config.TORCH_RADIUS, config.FOV_LIGHT_WALLS, config.FOV_ALGO)
+        self.fov_generation += 1
+        self.fov_needs_recompute = False
+
+    def __getstate__(self):
+        """
+        libtcod handles don't survive pickling;
+        initialize_fov() recreates them after loading.
+        """
+        state = self.__dict__.copy()
+        state['fov_map'] = None
+        state['changed_cells'] = None
+        return state
+
+    def fov_cell(self, x, y):
+        """
+        Returns (transparent, walkable) for a single tile;
+        the per-tile equivalent of fov_masks().
+        """
+        terrain = terrain_types[self.terrain[x, y]]
+        transparent = not terrain.blocks_sight
+        walkable = not terrain.blocks
+        for obj in self._objects_at.get((x, y), ()):
+            if obj.blocks_sight:
+                transparent = False
+            if obj.blocks:
+                walkable = False
+        return (transparent, walkable)
+
+    def invalidate_fov_cell(self, x, y):
+        """
+        Note that the terrain or blocking objects at (x, y) have changed,
+        so any cached copies of its FOV properties are out of date.
+        """
+        pass
+
+    def tile_changed(self, x, y):
+        """
+        Bring the FOV state for (x, y) up to date after its terrain or
+        blocking objects changed. Only requests a FOV recompute if the
+        tile's transparency actually changed.
+        """
+        self.invalidate_fov_cell(x, y)
+        if self.changed_cells is not None:
+            self.changed_cells.add((x, y))
+        if self.fov_map is None:
+            return
+        (transparent, walkable) = self.fov_cell(x, y)
+        if libtcod.map_is_transparent(self.fov_map, x, y) != transparent:
+            self.fov_needs_recompute = True
+        libtcod.map_set_properties(self.fov_map, x, y, transparent, walkable)
+
+    def set_terrain(self, pos, terrain):
+        """
+        Change the terrain index at (pos) during play.
+        """
+        self.terrain[pos.x, pos.y] = terrain
+        self._tile_versions[pos.x, pos.y] += 1
+        self._terrain_changes.append((pos.x, pos.y))
+        self.terrain_version += 1
+        self.tile_changed(pos.x, pos.y)
+
+    def terrain_changes_since(self, version):
+        """
+        Returns (xs, ys) arrays of the tiles whose terrain has changed
+        since terrain_version was (version).
+        """
+        changes = self._terrain_changes[version:]
+        return (numpy.array([x for (x, y) in changes], dtype=numpy.intp),
+                numpy.array([y for (x, y) in changes], dtype=numpy.intp))
+
+    def fov_masks(self):
+        """
+        Returns (transparent, walkable) boolean grids for the whole map:
+        terrain properties with blocking objects overlaid.
+        """
+        transparent = terrain_transparent[self.terrain]
+        walkable = terrain_walkable[self.terrain]
         for obj in self.objects:
-            if obj.blocks_sight or obj.blocks:
-                # print(obj.name, obj.pos)
-                blocks = obj.blocks or terrain_types[self.terrain[obj.pos.x][obj.pos.y]].blocks
-                blocks_sight = obj.blocks_sight or terrain_types[self.terrain[obj.pos.x][obj.pos.y]].blocks_sight
-                libtcod.map_set_properties(self.fov_map, obj.pos.x, obj.pos.y, not blocks_sight, not blocks)
+            if obj.blocks_sight:
+                transparent[obj.pos.x, obj.pos.y] = False
+            if obj.blocks:
+                walkable[obj.pos.x, obj.pos.y] = False
+        return (transparent, walkable)
 
     def terrain_index_at(self, pos):
-        return self.terrain[pos.x][pos.y]
+        return self.terrain[pos.x, pos.y]
 
     def terrain_at(self, pos):
         """
         Returns the Terrain at (pos).
         position *must* be within the current map.
         """
-        return terrain_types[self.terrain[pos.x][pos.y]]
+        return terrain_types[self.terrain[pos.x, pos.y]]
+
+    def reindex_objects(self):
+        """
+        Rebuild the tile -> objects index from scratch.
+        Each tile's list preserves the order of self.objects.
+        """
+        self._objects_at = {}
+        for obj in self.objects:
+            if obj.pos is not None:
+                self._objects_at.setdefault((obj.pos.x, obj.pos.y), []).append(obj)
+        self._tile_versions += 1
+        self.changed_cells = None
+
+    def objects_at(self, pos):
+        """
+        Returns the objects on tile (pos), in drawing order.
+        The caller must not modify the returned list.
+        """
+        return self._objects_at.get((pos.x, pos.y), ())
+
+    def objects_near(self, pos, radius):
+        """
+        Returns a list of the objects within (radius) tiles of (pos)
+        along both axes. Scans either those tiles or the occupied ones,
+        whichever is fewer.
+        """
+        found = []
+        if (2 * radius + 1) ** 2 < len(self._objects_at):
+            for x in range(max(0, pos.x - radius), min(self.width, pos.x + radius + 1)):
+                for y in range(max(0, pos.y - radius), min(self.height, pos.y + radius + 1)):
+                    found.extend(self._objects_at.get((x, y), ()))
+        else:
+            for ((x, y), tile) in self._objects_at.items():
+                if abs(x - pos.x) <= radius and abs(y - pos.y) <= radius:
+                    found.extend(tile)
+        return found
+
+    def wake(self, obj):
+        """
+        Have (obj) act now, unless it's already on the timeline.
+        """
+        if obj not in self._scheduled:
+            self.schedule(obj, self.time)
+
+    def schedule(self, obj, when):
+        """
+        Have (obj) act at (when), replacing any time it was due before.
+        """
+        self._timeline_count += 1
+        self._scheduled[obj] = self._timeline_count
+        heapq.heappush(self.timeline, (when, self._timeline_count, obj))
+
+    def unschedule(self, obj):
+        """
+        Take (obj) off the timeline; its entry stays in the heap,
+        to be discarded when it comes due.
+        """
+        self._scheduled.pop(obj, None)
+        self.last_acted.pop(obj, None)
+
+    def is_scheduled(self, obj):
+        return obj in self._scheduled
+
+    def pop_due(self, end):
+        """
+        Returns (time, object) for the first object due before (end),
+        taking it off the timeline, or None if there isn't one.
+        """
+        while self.timeline and self.timeline[0][0] < end:
+            (when, count, obj) = heapq.heappop(self.timeline)
+            if self._scheduled.get(obj) == count:
+                del self._scheduled[obj]
+                return (when, obj)
+        return None
+
+    def tile_version(self, pos):
+        """
+        Returns a number that changes whenever the objects or terrain
+        on tile (pos) do.
+        """
+        return self._tile_versions[pos.x, pos.y]
+
+    def add_object(self, obj, at_end=False):
+        """
+        Place obj on the map at obj.pos. By default it goes to the front
+        of self.objects (drawn beneath everything else); at_end puts it
+        at the back instead.
+        """
+        tile = self._objects_at.setdefault((obj.pos.x, obj.pos.y), [])
+        if at_end:
+            self.objects.append(obj)
+            tile.append(obj)
+        else:
+            self.objects.insert(0, obj)
+            tile.insert(0, obj)
+        self._tile_versions[obj.pos.x, obj.pos.y] += 1
+        if obj.blocks or obj.blocks_sight:
+            self.tile_changed(obj.pos.x, obj.pos.y)
+
+    def remove_object(self, obj):
+        self.objects.remove(obj)
+        self._unindex(obj)
+        self.unschedule(obj)
+        if obj.blocks or obj.blocks_sight:
+            self.tile_changed(obj.pos.x, obj.pos.y)
+
+    def move_object(self, obj, pos):
+        """
+        Change obj.pos, keeping the index up to date.
+        """
+        old_pos = obj.pos
+        self._unindex(obj)
+        obj.pos = pos
+        self._objects_at.setdefault((pos.x, pos.y), []).append(obj)
+        self._tile_versions[pos.x, pos.y] += 1
+        if obj.blocks or obj.blocks_sight:
+            self.tile_changed(old_pos.x, old_pos.y)
+            self.tile_changed(pos.x, pos.y)
+
+    def _unindex(self, obj):
+        key = (obj.pos.x, obj.pos.y)
+        tile = self._objects_at.get(key)
+        if tile is None or obj not in tile:
+            return
+        tile.remove(obj)
+        self._tile_versions[key] += 1
+        if not tile:
+            del self._objects_at[key]
 
     def is_blocked_at(self, pos, ignore=None):
         """
         Returns true if impassible map terrain or any blocking objects
         are at (x, y).
         """
-        if terrain_types[self.terrain[pos.x][pos.y]].blocks:
+        if terrain_types[self.terrain[pos.x, pos.y]].blocks:
             return True
-        for object in self.objects:
-            if object.blocks and object.pos == pos and object != ignore:
+        for object in self.objects_at(pos):
+            if object.blocks and object != ignore:
                 return True
         return False
 
     def is_explored(self, pos):
-        return self._explored[pos.x][pos.y]
+        return self._explored[pos.x, pos.y]
 
     def explore(self, pos):
-        self._explored[pos.x][pos.y] = True
+        self._explored[pos.x, pos.y] = True
 
     def is_blocked_from(self, origin, dest, ignore=None):
         return self.is_blocked_at(dest, ignore)
@@ -179,7 +467,7 @@ class DungeonMap(BaseMap):
         self.rooms = []
         self.room_entered = []
 
-        self.room = [[-1 for y in range(height)] for x in range(width)]
+        self.room = new_grid(width, height, -1, numpy.int16)
 
         self.fov_elevation_changed = False  # HACK
 
@@ -197,36 +485,103 @@ class OutdoorMap(BaseMap):
 
         self.fov_elevation_changed = False
 
-        self.region = [[-1 for y in range(height)] for x in range(width)]
+        self.region = new_grid(width, height, -1, numpy.int16)
 
         self.region_seeds = []
         self.region_elevations = []
         self.region_terrain = []
 
+        # Per-tile copies of region_elevations[region] and
+        # region_terrain[region]; see rebuild_region_grids().
+        self.tile_elevation = new_grid(width, height, 0, numpy.int16)
+        self.tile_region_terrain = new_grid(width, height, None, object)
+        # (xs, ys, bounds) listing the tiles of each region; see region_cells().
+        self._region_cells = None
+
         self.region_entered = []
         self.elevation_visited = []
 
+        # One libtcod map per viewer elevation, built on demand;
+        # switching elevation copies the cached map into fov_map.
+        self._fov_layers = {}
+        # Cells changed since each cached layer was last brought up to date.
+        self._stale_fov_cells = {}
+        # Elevation fov_map currently reflects, if any.
+        self._fov_elevation = None
+
+    def initialize_fov(self):
+        for layer in self._fov_layers.values():
+            libtcod.map_delete(layer)
+        self._fov_layers = {}
+        self._stale_fov_cells = {}
+        self._fov_elevation = None
+        super(OutdoorMap, self).initialize_fov()
+        # fov_map was built without elevation; apply it before the next draw.
+        self.fov_elevation_changed = True
+
+    def __getstate__(self):
+        state = super(OutdoorMap, self).__getstate__()
+        state['_fov_layers'] = {}
+        state['_stale_fov_cells'] = {}
+        return state
+
+    def fov_cell(self, x, y, elevation=None):
+        """
+        As BaseMap.fov_cell(); (elevation) defaults to the one
+        fov_map was last set up for.
+        """
+        if elevation is None:
+            elevation = self._fov_elevation
+        (transparent, walkable) = super(OutdoorMap, self).fov_cell(x, y)
+        if elevation is not None and self.elevation(x, y) > elevation + 1:
+            transparent = False
+        return (transparent, walkable)
+
+    def invalidate_fov_cell(self, x, y):
+        for elevation in list(self._fov_layers.keys()):
+            stale = self._stale_fov_cells[elevation]
+            stale.add((x, y))
+            if len(stale) > MAX_STALE_FOV_CELLS:
+                # Cheaper to rebuild from scratch if it's ever used again.
+                libtcod.map_delete(self._fov_layers.pop(elevation))
+                del self._stale_fov_cells[elevation]
+
+    def _fov_layer(self, elevation):
+        """
+        Returns the cached libtcod map for a viewer at (elevation),
+        building it or refreshing its stale cells as needed.
+        """
+        layer = self._fov_layers.get(elevation)
+        if layer is None:
+            layer = libtcod.map_new(self.width, self.height)
+            (transparent, walkable) = self.fov_masks(elevation)
+            push_fov_masks(layer, transparent, walkable)
+            self._fov_layers[elevation] = layer
+            self._stale_fov_cells[elevation] = set()
+            return layer
+
+        stale = self._stale_fov_cells[elevation]
+        for (x, y) in stale:
+            (transparent, walkable) = self.fov_cell(x, y, elevation)
+            libtcod.map_set_properties(layer, x, y, transparent, walkable)
+        stale.clear()
+        return layer
+
+    def fov_masks(self, elevation=None):
+        """
+        As BaseMap.fov_masks(); if a viewer's elevation is given,
+        anything more than one step above it also blocks sight.
+        """
+        (transparent, walkable) = super(OutdoorMap, self).fov_masks()
+        if elevation is not None:
+            transparent &= (self.tile_elevation <= elevation + 1)
+        return (transparent, walkable)
+
     def set_fov_elevation(self, player):
         elevation = self.elevation(player.pos.x, player.pos.y)
-        self.fov_needs_recompute = True
-        self.fov_map = libtcod.map_new(self.width, self.height)
-        for y in range(self.height):
-            for x in range(self.width):
-                blocks_sight = (terrain_types[self.terrain[x][y]].blocks_sight or
-                                (self.region_elevations[self.region[x][y]] > elevation + 1))
-                libtcod.map_set_properties(
-                    self.fov_map, x, y,
-                    not blocks_sight, not terrain_types[self.terrain[x][y]].blocks)
-        for obj in self.objects:
-            if obj.blocks_sight or obj.blocks:
-                blocks = obj.blocks or terrain_types[self.terrain[obj.pos.x][obj.pos.y]].blocks
-                blocks_sight = (obj.blocks_sight or
-                    terrain_types[self.terrain[obj.pos.x][obj.pos.y]].blocks_sight or
-                    (self.region_elevations[self.region[x][y]] > elevation + 1))
-                libtcod.map_set_properties(self.fov_map, obj.pos.x, obj.pos.y, not blocks_sight, not blocks)
-        libtcod.map_compute_fov(
-            player.current_map.fov_map, player.x,
-            player.y, config.TORCH_RADIUS, config.FOV_LIGHT_WALLS, config.FOV_ALGO)
+        libtcod.map_copy(self._fov_layer(elevation), self.fov_map)
+        self._fov_elevation = elevation
+        self.compute_fov(player.pos)
 
     def is_blocked_from(self, origin, dest, ignore=None):
         """
@@ -252,4 +607,44 @@ class OutdoorMap(BaseMap):
         return "You're not prepared to cross the full width of the desert; right now, that way lies only death."
 
     def elevation(self, x, y):
-        return self.region_elevations[self.region[x][y]]
\ No newline at end of file
+        return self.tile_elevation[x, y]
+
+    def rebuild_region_grids(self):
+        """
+        Recompute tile_elevation and tile_region_terrain from scratch.
+        Call after bulk edits to region, region_elevations or region_terrain.
+        """
+        self.tile_elevation = numpy.array(self.region_elevations, dtype=numpy.int16)[self.region]
+        self.tile_region_terrain = numpy.array(self.region_terrain, dtype=object)[self.region]
+        self._region_cells = None
+
+    def region_cells(self, r):
+        """
+        Returns (xs, ys) index arrays of the tiles in region r.
+        """
+        if self._region_cells is None:
+            order = numpy.argsort(self.region, axis=None, kind='mergesort')
+            counts = numpy.bincount(self.region.ravel(),
+                                    minlength=len(self.region_elevations))
+            bounds = numpy.concatenate(([0], numpy.cumsum(counts)))
+            (xs, ys) = numpy.unravel_index(order, self.region.shape)
+            self._region_cells = (xs, ys, bounds)
+        (xs, ys, bounds) = self._region_cells
+        return (xs[bounds[r]:bounds[r+1]], ys[bounds[r]:bounds[r+1]])
+
+    def set_region_elevation(self, r, elevation):
+        self.region_elevations[r] = elevation
+        self.tile_elevation[self.region_cells(r)] = elevation
+
+    def set_region_terrain(self, r, terrain):
+        self.region_terrain[r] = terrain
+        self.tile_region_terrain[self.region_cells(r)] = terrain
+
+    def set_region_at(self, x, y, r):
+        """
+        Move tile (x, y) into region r.
+        """
+        self.region[x, y] = r
+        self.tile_elevation[x, y] = self.region_elevations[r]
+        self.tile_region_terrain[x, y] = self.region_terrain[r]
+        self._region_cells = None
\ No newline at end of file
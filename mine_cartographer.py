@@ -1,6 +1,5 @@
 # Copyright 2016 Thomas C. Hudson
 # Governed by the license described in LICENSE.txt
-import copy
 
 import libtcodpy as libtcod
 
@@ -88,7 +87,7 @@ def _link_up_stairs(new_map, old_map, old_quarry_stairs):
         stairs = Object(old_quarry_stairs[i].dest_position, '>', 'mine exit', libtcod.white, always_visible=True)
         stairs.destination = old_map
         stairs.dest_position = old_quarry_stairs[i].pos
-        new_map.objects.insert(0, stairs)
+        new_map.add_object(stairs)
         new_map.portals.insert(0, stairs)
 
 
@@ -117,7 +116,7 @@ def _descend_stairs(new_map, player, old_quarry_stairs):
             return
 
 def _dig_some_caves(new_map, old_quarry_stairs):
-    new_map.spare_terrain = copy.deepcopy(new_map.terrain) # [[0 for y in range(new_map.height)] for x in range(new_map.width)]
+    new_map.spare_terrain = new_map.terrain.copy()
 
     new_map.cave_zones = []
     x = new_map.rnd(3, old_quarry_stairs[1].dest_position.x / 2)
@@ -233,7 +232,7 @@ def make_map(player, dungeon_level):
     new_map.objects.append(player)
     player.current_map = new_map
     player.camera_position = algebra.Location(0, 0)
-    new_map.random_seed = libtcod.random_save(0)
+    new_map.random_seed = map.new_seed()
     new_map.rng = libtcod.random_new_from_seed(new_map.random_seed)
 
     old_quarry_stairs = old_map.quarry_stairs
@@ -261,10 +260,8 @@ def make_map(player, dungeon_level):
         ca_cartographer._floodfill(new_map, stair_pos.x, stair_pos.y,
             map.TERRAIN_GROUND, map.TERRAIN_FLOOR)
 
-    for x in range(1, new_map.width-1):
-        for y in range(1, new_map.height-1):
-            if new_map.terrain[x][y] == map.TERRAIN_GROUND:
-                new_map.terrain[x][y] = map.TERRAIN_WALL
+    interior = new_map.terrain[1:new_map.width-1, 1:new_map.height-1]
+    interior[interior == map.TERRAIN_GROUND] = map.TERRAIN_WALL
 
     #for x in range(0, new_map.width):
     #    new_map.terrain[x][0] = map.TERRAIN_WALL
@@ -300,10 +297,10 @@ def make_map(player, dungeon_level):
     while new_map.is_blocked_at(pos):
         pos += actions.random_direction()
 
-    new_map.objects.insert(0, Object(pos, '%', "hero's corpse", libtcod.dark_red))
+    new_map.add_object(Object(pos, '%', "hero's corpse", libtcod.dark_red))
     sword = miscellany.the_black_sword()
     sword.pos = pos
-    new_map.objects.insert(0, sword)
+    new_map.add_object(sword)
 
     new_map.initialize_fov()
     new_map.xp_visit = _dungeon_exploration
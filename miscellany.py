@@ -23,10 +23,8 @@ def open_door(pos):
 
 def _do_open_door(actor, target):
     replacement = open_door(target.pos)
-    actor.current_map.objects.insert(0, replacement)
-    actor.current_map.objects.remove(target)
-    actor.current_map.fov_needs_recompute = True
-    actor.current_map.fov_elevation_changed = True
+    actor.current_map.add_object(replacement)
+    actor.current_map.remove_object(target)
     log.message(actor.name.capitalize() + ' opens a door.')
 
 
@@ -40,9 +38,8 @@ def _do_harvest_honey(actor, target):
         return
     log.message(actor.name.capitalize() + ' eats some refreshing honey.')
     actor.fighter.exhaustion = max(actor.fighter.exhaustion - 600, 0)
-    actor.current_map.terrain[target.pos.x][target.pos.y] = 9
-    actor.current_map.fov_needs_recompute = True
-    actor.current_map.objects.remove(target)
+    actor.current_map.remove_object(target)
+    actor.current_map.set_terrain(target.pos, 9)
 
 ######################
 
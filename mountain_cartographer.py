@@ -3,6 +3,7 @@
 import libtcodpy as libtcod
 
 import cProfile
+import numpy
 import scipy.spatial.kdtree
 
 import config
@@ -105,7 +106,7 @@ def _place_random_creatures(new_map, player):
 def _inhabit_rotunda(new_map, peak):
     goddess = Object(algebra.Location(peak[0], peak[1]), '@', 'The White Goddess', libtcod.white, blocks=True,
         interactable=Interactable(use_function=quest.goddess_charge))
-    new_map.objects.append(goddess)
+    new_map.add_object(goddess, at_end=True)
 
 
 def _inhabit_quarry(new_map, player):
@@ -208,16 +209,16 @@ def _place_seaside_height(new_map):
         if new_map.region_terrain[r-20] != 'lake':
             print('Not lakeside...')
             continue
-        new_map.region_elevations[r] = 1
-        new_map.region_terrain[r] = 'scrub'
+        new_map.set_region_elevation(r, 1)
+        new_map.set_region_terrain(r, 'scrub')
         new_map.grotto_region = r
         if (r+1)/20 == r/20:
-            new_map.region_elevations[r+1] = 2
-            new_map.region_terrain[r+1] = 'forest'
+            new_map.set_region_elevation(r+1, 2)
+            new_map.set_region_terrain(r+1, 'forest')
             new_map.grotto_region = r
         if (r+2)/20 == r/20:
-            new_map.region_elevations[r+2] = 1
-            new_map.region_terrain[r+2] = 'scrub'
+            new_map.set_region_elevation(r+2, 1)
+            new_map.set_region_terrain(r+2, 'scrub')
         return
 
     print("Whoops! Can't find anywhere to place a seaside grotto.")
@@ -228,7 +229,7 @@ def _should_slope(new_map, x, y):
     """
     True if any adjacent tile is higher than this one.
     """
-    el = new_map.region_elevations[new_map.region[x][y]]
+    el = new_map.tile_elevation[x, y]
     return (new_map.elevation(x-1, y-1) == el+1 or
             new_map.elevation(x, y-1) == el+1 or
             new_map.elevation(x+1, y-1) == el+1 or
@@ -250,10 +251,16 @@ def _find_terrain_types(new_map):
 
 def _mark_slopes(new_map):
     print('Finding the slopes')
-    for x in range(1, config.OUTDOOR_MAP_WIDTH - 1):
-        for y in range(1, config.OUTDOOR_MAP_HEIGHT - 1):
-            if _should_slope(new_map, x, y):
-                new_map.terrain[x][y] = map.TERRAIN_SLOPE
+    # Vectorized _should_slope() over every tile not on the map edge.
+    el = new_map.tile_elevation
+    (w, h) = el.shape
+    higher = el[1:w-1, 1:h-1] + 1
+    slope = numpy.zeros(higher.shape, dtype=numpy.bool_)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx != 0 or dy != 0:
+                slope |= (el[1+dx:w-1+dx, 1+dy:h-1+dy] == higher)
+    new_map.terrain[1:w-1, 1:h-1][slope] = map.TERRAIN_SLOPE
 
 
 def _clump_terrain(new_map):
@@ -303,7 +310,7 @@ def _assign_terrain(new_map):
     print('Assigning narrow terrain')
     for x in range(config.OUTDOOR_MAP_WIDTH):
         for y in range(config.OUTDOOR_MAP_HEIGHT):
-           t = new_map.region_terrain[new_map.region[x][y]]
+           t = new_map.tile_region_terrain[x, y]
            if new_map.terrain[x][y] != map.TERRAIN_GROUND and t != 'lake':
                 # For now don't overwrite slopes, except underwater
                 continue
@@ -320,7 +327,7 @@ def _make_rotunda(new_map, peak):
             if new_map.elevation(x, y) != 9:
                 # in theory would be better to glom onto a closer region
                 # if one exists
-                new_map.region[x][y] = new_map.region[peak[0]][peak[1]]
+                new_map.set_region_at(x, y, new_map.region[peak[0], peak[1]])
             # interior of rotunda is floor, edges are bare ground
             if (x > peak[0]-3 and x < peak[0]+3 and
                     y > peak[1]-3 and y < peak[1]+3):
@@ -416,8 +423,8 @@ def _dig_quarry(new_map, peak):
     # Stopgap: drop the entire region, reevaluate for slopes,
     # and rewrite terrain.
     for rgn in new_map.quarry_regions:
-        new_map.region_elevations[rgn] = 2
-        new_map.region_terrain[rgn] = 'rock'
+        new_map.set_region_elevation(rgn, 2)
+        new_map.set_region_terrain(rgn, 'rock')
 
     for rgn in new_map.quarry_regions:
         _mark_quarry_slopes(new_map, rgn)
@@ -446,7 +453,7 @@ def _dig_quarry(new_map, peak):
         stairs.destination = None
         stairs.dest_position = None
         stairs.generator = mine_cartographer.make_map
-        new_map.objects.insert(0, stairs)
+        new_map.add_object(stairs)
         new_map.portals.insert(0, stairs)
         new_map.quarry_stairs.append(stairs)
 
@@ -462,7 +469,7 @@ def _make_grotto(new_map):
     stairs.destination = None
     stairs.dest_position = None
     stairs.generator = ca_cartographer.make_map
-    new_map.objects.insert(0, stairs)
+    new_map.add_object(stairs)
     new_map.portals.insert(0, stairs)
     new_map.grotto_stairs = region_center
 
@@ -503,7 +510,7 @@ def _site_final_dungeon(new_map, strata):
         stairs.destination = None
         stairs.dest_position = None
         stairs.generator = dungeon_cartographer.make_final_map
-        new_map.objects.insert(0, stairs)
+        new_map.add_object(stairs)
         new_map.portals.insert(0, stairs)
         new_map.dungeon_stairs.append(stairs)
         for x in range(ii.x - 2, ii.x + 3):
@@ -547,11 +554,11 @@ def _build_map(new_map):
     new_map.elevation_visited = [False for i in range(0,10)]
 
     print('Assigning regions')
-    for x in range(config.OUTDOOR_MAP_WIDTH):
-        for y in range(config.OUTDOOR_MAP_HEIGHT):
-            (d, i) = region_tree.query([[x, y]])
-            new_map.region[x][y] = i[0]
-            new_map.terrain[x][y] = map.TERRAIN_GROUND
+    # One batched query for every tile instead of one query per tile.
+    (xs, ys) = numpy.mgrid[0:config.OUTDOOR_MAP_WIDTH, 0:config.OUTDOOR_MAP_HEIGHT]
+    (d, i) = region_tree.query(numpy.column_stack((xs.ravel(), ys.ravel())))
+    new_map.region[:, :] = i.reshape(new_map.region.shape)
+    new_map.terrain[:, :] = map.TERRAIN_GROUND
 
     peak = [libtcod.random_get_int(new_map.rng, int(config.OUTDOOR_MAP_WIDTH * .35), int(config.OUTDOOR_MAP_WIDTH * .65)),
             libtcod.random_get_int(new_map.rng, int(config.OUTDOOR_MAP_WIDTH * .35), int(config.OUTDOOR_MAP_WIDTH * .65))]
@@ -573,6 +580,7 @@ def _build_map(new_map):
     _debug_region_heights(new_map)
 
     _clump_terrain(new_map)
+    new_map.rebuild_region_grids()
     _place_seaside_height(new_map)
     # TODO: level_desert() here to guarantee caravanserai is in the northeast
     # TODO: sink_quarry() here before we _mark_slopes
@@ -594,7 +602,7 @@ def _build_map(new_map):
 
 def _mountain_exploration(self, player):
     new_region = self.region[player.pos.x][player.pos.y]
-    new_elevation = self.region_elevations[new_region]
+    new_elevation = self.tile_elevation[player.pos.x, player.pos.y]
     delta = 0
     if not self.region_entered[new_region]:
         delta += config.REGION_EXPLORATION_SP
@@ -620,7 +628,7 @@ def make_map(player, dungeon_level):
     new_map.objects.append(player)
     player.current_map = new_map
     player.camera_position = algebra.Location(0, 0)
-    new_map.random_seed = libtcod.random_save(0)
+    new_map.random_seed = map.new_seed()
     _build_map(new_map)
 
     # Might want to change this later, but this is required in creature placement
@@ -653,20 +661,37 @@ def make_map(player, dungeon_level):
 def _test_map_repeatability():
     """
     Require that two calls to _build_map() with the same seed produce the
-    same corridors and rooms.
+    same terrain and regions.
     """
-    map1 = map.OutdoorMap(config.MAP_WIDTH, config.MAP_HEIGHT, 3)
-    map1.random_seed = libtcod.random_save(0)
+    map1 = map.OutdoorMap(config.OUTDOOR_MAP_WIDTH, config.OUTDOOR_MAP_HEIGHT, 3)
+    map1.random_seed = map.new_seed()
     _build_map(map1)
 
-    map2 = map.OutdoorMap(config.MAP_WIDTH, config.MAP_HEIGHT, 3)
+    map2 = map.OutdoorMap(config.OUTDOOR_MAP_WIDTH, config.OUTDOOR_MAP_HEIGHT, 3)
     map2.random_seed = map1.random_seed
     _build_map(map2)
 
-    assert map1.terrain == map2.terrain
-    for i in range(len(map1.rooms)):
-        assert map1.rooms[i] == map2.rooms[i]
+    assert numpy.array_equal(map1.terrain, map2.terrain)
+    assert numpy.array_equal(map1.region, map2.region)
+
+
+def _test_region_grids():
+    """
+    Require that the incrementally updated per-tile region grids match
+    a rebuild from the region tables.
+    """
+    new_map = map.OutdoorMap(config.OUTDOOR_MAP_WIDTH, config.OUTDOOR_MAP_HEIGHT, 0)
+    new_map.random_seed = map.new_seed()
+    _build_map(new_map)
+
+    tile_elevation = new_map.tile_elevation.copy()
+    tile_region_terrain = new_map.tile_region_terrain.copy()
+    new_map.rebuild_region_grids()
+    assert numpy.array_equal(tile_elevation, new_map.tile_elevation)
+    assert numpy.array_equal(tile_region_terrain, new_map.tile_region_terrain)
+
 
 if __name__ == '__main__':
+    _test_region_grids()
     _test_map_repeatability()
     print('Cartographer tests complete.')
@@ -0,0 +1,328 @@
+"""
+Shared pathfinding services for the AI.
+
+pathing.flow_step(monster, player) returns the monster's next step
+  towards the player along a flow field shared by every monster:
+  one breadth-first pass per turn outwards from the player, over the
+  tiles within config.AI_FLOW_RADIUS that can be walked and climbed.
+pathing.path_step(monster, goal, path) returns the monster's next step
+  towards any other goal along (path), a CachedPath it keeps between
+  turns; A* is only rerun when the goal moves or a tile on the path
+  becomes blocked. Every search on a map shares one libtcod path object.
+"""
+# Copyright 2016 Thomas C. Hudson
+# Governed by the license described in LICENSE.txt
+import libtcodpy as libtcod
+import numpy
+
+import algebra
+import config
+import map
+
+UNREACHED = numpy.iinfo(numpy.int32).max
+# How many turns a monster waits before searching again
+# for a goal it couldn't find a way to.
+RETRY_TURNS = 5
+
+_field = None
+""" the FlowField for the current turn """
+_field_key = None
+""" (map, player x, player y, turn, radius) _field was computed for """
+_path_map = None
+""" the PathMap for the map monsters are currently moving on """
+
+path_computations = 0
+""" number of A* searches run, for benchmarking """
+
+
+def _shifted(dx, dy, width, height):
+    """
+    Returns (to, frm) pairs of slices such that array[to] is the
+    neighbor in direction (dx, dy) of array[frm], over a (width, height) grid.
+    """
+    to = (slice(max(dx, 0), width + min(dx, 0)),
+          slice(max(dy, 0), height + min(dy, 0)))
+    frm = (slice(max(-dx, 0), width + min(-dx, 0)),
+           slice(max(-dy, 0), height + min(-dy, 0)))
+    return (to, frm)
+
+
+class FlowField(object):
+    """
+    Number of steps to (origin) from each tile within (radius) of it,
+    moving only onto walkable tiles at most one elevation step apart.
+    Mobile blockers (anything with a fighter) are ignored, so that
+    a pack doesn't wall itself off from its prey.
+    """
+    def __init__(self, current_map, origin, radius):
+        self.x0 = max(0, origin.x - radius)
+        self.y0 = max(0, origin.y - radius)
+        x1 = min(current_map.width, origin.x + radius + 1)
+        y1 = min(current_map.height, origin.y + radius + 1)
+        window = (slice(self.x0, x1), slice(self.y0, y1))
+        (width, height) = (x1 - self.x0, y1 - self.y0)
+
+        passable = map.terrain_walkable[current_map.terrain[window]]
+        for obj in current_map.objects:
+            if (obj.blocks and not obj.fighter and
+                    self.x0 <= obj.pos.x < x1 and self.y0 <= obj.pos.y < y1):
+                passable[obj.pos.x - self.x0, obj.pos.y - self.y0] = False
+        if current_map.is_outdoors:
+            elevation = current_map.tile_elevation[window]
+        else:
+            elevation = numpy.zeros((width, height), dtype=numpy.int16)
+
+        self.distance = numpy.full((width, height), UNREACHED, dtype=numpy.int32)
+        frontier = numpy.zeros((width, height), dtype=numpy.bool_)
+        frontier[origin.x - self.x0, origin.y - self.y0] = True
+        self.distance[frontier] = 0
+        shifts = [_shifted(d.x, d.y, width, height) for d in algebra.directions]
+        steps = 0
+        while frontier.any():
+            steps += 1
+            reached = numpy.zeros((width, height), dtype=numpy.bool_)
+            for (to, frm) in shifts:
+                reached[to] |= (frontier[frm] & passable[to] &
+                                (self.distance[to] == UNREACHED) &
+                                (abs(elevation[to] - elevation[frm]) <= 1))
+            self.distance[reached] = steps
+            frontier = reached
+
+    def at(self, x, y):
+        """
+        Returns the number of steps from map position (x, y) to the origin,
+        or UNREACHED.
+        """
+        x -= self.x0
+        y -= self.y0
+        if (x < 0 or y < 0 or
+                x >= self.distance.shape[0] or y >= self.distance.shape[1]):
+            return UNREACHED
+        return self.distance[x, y]
+
+
+def flow_field(player, radius=None):
+    """
+    Returns the FlowField towards the player for this turn,
+    computing it on the first request.
+    """
+    global _field, _field_key
+    if radius is None:
+        radius = config.AI_FLOW_RADIUS
+    key = (player.current_map, player.pos.x, player.pos.y, player.turn_count, radius)
+    if _field is None or key != _field_key:
+        _field = FlowField(player.current_map, player.pos, radius)
+        _field_key = key
+    return _field
+
+
+def flow_step(monster, player):
+    """
+    Returns the Direction of the monster's best free step towards the
+    player, or None if it's beyond the flow field or can't get closer.
+    """
+    field = flow_field(player)
+    best = field.at(monster.pos.x, monster.pos.y)
+    if best == UNREACHED:
+        return None
+    step = None
+    current_map = monster.current_map
+    for direction in algebra.directions:
+        goal = monster.pos + direction
+        distance = field.at(goal.x, goal.y)
+        if (distance < best and
+                not current_map.is_blocked_from(monster.pos, goal)):
+            best = distance
+            step = direction
+    return step
+
+
+class PathMap(object):
+    """
+    A libtcod map and path object shared by every search on (current_map).
+    Cells are walkable if their terrain is and no blocking object is on
+    them; outdoors, cells at the edge of a cliff (next to a tile more than
+    one elevation step up or down) are left out too, since the map can't
+    express that a step between two walkable cells is forbidden.
+    Kept up to date from the map's changed_cells, so a search only pushes
+    the cells whose terrain or blocking objects changed since the last.
+    """
+    def __init__(self, current_map):
+        self.current_map = current_map
+        self.tcod_map = libtcod.map_new(current_map.width, current_map.height)
+        self.path = libtcod.path_new_using_map(self.tcod_map)
+        self.cliff = None
+        self.walkable = None
+
+    def delete(self):
+        self.current_map.changed_cells = None
+        libtcod.path_delete(self.path)
+        libtcod.map_delete(self.tcod_map)
+
+    def _find_cliffs(self):
+        current_map = self.current_map
+        (width, height) = (current_map.width, current_map.height)
+        self.cliff = numpy.zeros((width, height), dtype=numpy.bool_)
+        if current_map.is_outdoors:
+            elevation = current_map.tile_elevation
+            for d in algebra.directions:
+                (to, frm) = _shifted(d.x, d.y, width, height)
+                self.cliff[frm] |= abs(elevation[to] - elevation[frm]) > 1
+
+    def _cell_walkable(self, x, y):
+        current_map = self.current_map
+        if self.cliff[x, y] or not map.terrain_walkable[current_map.terrain[x, y]]:
+            return False
+        for obj in current_map.objects_at(algebra.Location(x, y)):
+            if obj.blocks:
+                return False
+        return True
+
+    def _sync(self):
+        """
+        Push the cells that changed since the last search, or all of
+        them if the map isn't tracking changes for us yet.
+        """
+        current_map = self.current_map
+        if current_map.changed_cells is None or self.walkable is None:
+            if self.cliff is None:
+                self._find_cliffs()
+            self.walkable = map.terrain_walkable[current_map.terrain] & ~self.cliff
+            for obj in current_map.objects:
+                if obj.blocks:
+                    self.walkable[obj.pos.x, obj.pos.y] = False
+            map.push_fov_masks(self.tcod_map, self.walkable, self.walkable)
+            current_map.changed_cells = set()
+            return
+        for (x, y) in current_map.changed_cells:
+            walkable = self._cell_walkable(x, y)
+            if walkable != self.walkable[x, y]:
+                self.walkable[x, y] = walkable
+                libtcod.map_set_properties(self.tcod_map, x, y, walkable, walkable)
+        current_map.changed_cells.clear()
+
+    def compute(self, mover, goal):
+        """
+        Returns the list of Locations from (mover) to (goal), last step first,
+        or an empty list if there's no way there.
+        Neither the mover's cell nor the goal's counts as an obstacle,
+        even on a cliff edge, so long as its terrain can be walked.
+        """
+        global path_computations
+        path_computations += 1
+        self._sync()
+        terrain = self.current_map.terrain
+        opened = []
+        for pos in (mover.pos, goal):
+            if (not self.walkable[pos.x, pos.y] and
+                    map.terrain_walkable[terrain[pos.x, pos.y]]):
+                libtcod.map_set_properties(self.tcod_map, pos.x, pos.y, True, True)
+                opened.append(pos)
+        cells = []
+        if libtcod.path_compute(self.path, mover.pos.x, mover.pos.y,
+                                goal.x, goal.y):
+            cells = [algebra.Location(*libtcod.path_get(self.path, i))
+                     for i in range(libtcod.path_size(self.path) - 1, -1, -1)]
+        for pos in opened:
+            libtcod.map_set_properties(self.tcod_map, pos.x, pos.y, False, False)
+        return cells
+
+
+def path_map(current_map):
+    """
+    Returns the shared PathMap for (current_map); the previous map's
+    libtcod state is freed when monsters start moving on a new one.
+    """
+    global _path_map
+    if _path_map is None or _path_map.current_map is not current_map:
+        if _path_map is not None:
+            _path_map.delete()
+        _path_map = PathMap(current_map)
+    return _path_map
+
+
+class CachedPath(object):
+    """
+    One monster's route to (goal): cells holds the Locations still to walk,
+    last step first, and versions the map's tile_version() of each when it
+    was last found clear. A goal that couldn't be reached is remembered
+    with no cells, and only searched for again after RETRY_TURNS turns
+    or once the goal moves.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.goal = None
+        self.cells = []
+        self.versions = []
+        self.retry = 0
+
+    def is_blocked(self, current_map):
+        """
+        Returns true if a blocking object or terrain has appeared on any
+        tile still to be walked; only tiles whose version has changed
+        are examined. The goal itself may be occupied.
+        """
+        for i in range(len(self.cells)):
+            cell = self.cells[i]
+            version = current_map.tile_version(cell)
+            if version == self.versions[i]:
+                continue
+            if cell != self.goal and current_map.is_blocked_at(cell):
+                return True
+            self.versions[i] = version
+        return False
+
+
+def path_step(monster, goal, path):
+    """
+    Returns the Direction of the monster's next step along (path) towards
+    (goal), searching again only if the goal has moved, the monster has
+    strayed from the path, or a tile on it has been blocked.
+    Returns None if there's no way to (goal) or the monster is there.
+    """
+    current_map = monster.current_map
+    if monster.pos == goal:
+        path.clear()
+        return None
+    while path.cells and path.cells[-1] == monster.pos:
+        path.cells.pop()
+        path.versions.pop()
+    if path.goal == goal and not path.cells and path.retry > 0:
+        path.retry -= 1
+        return None
+
+    if (path.goal != goal or
+            not path.cells or
+            max(abs(path.cells[-1].x - monster.pos.x),
+                abs(path.cells[-1].y - monster.pos.y)) > 1 or
+            path.is_blocked(current_map)):
+        path.goal = algebra.Location(goal.x, goal.y)
+        path.cells = path_map(current_map).compute(monster, goal)
+        path.versions = [current_map.tile_version(cell) for cell in path.cells]
+        if not path.cells:
+            path.retry = RETRY_TURNS
+            return None
+
+    step = path.cells[-1]
+    return algebra.Direction(step.x - monster.pos.x, step.y - monster.pos.y)
+
+
+def _test_flow_field():
+    """
+    Require that a monster walks around a wall rather than into it.
+    """
+    new_map = map.DungeonMap(10, 10, 1)
+    new_map.terrain[1:9, 1:9] = map.TERRAIN_FLOOR
+    new_map.terrain[5, 1:8] = map.TERRAIN_WALL
+    field = FlowField(new_map, algebra.Location(7, 3), 5)
+    assert field.at(7, 3) == 0
+    assert field.at(3, 3) == 10
+    assert field.at(5, 3) == UNREACHED
+    assert field.at(0, 0) == UNREACHED
+
+
+if __name__ == '__main__':
+    _test_flow_field()
+    print('Pathing tests complete.')
@@ -1,12 +1,16 @@
 # Copyright 2016 Thomas C. Hudson
 # Governed by the license described in LICENSE.txt
 import libtcodpy as libtcod
+import numpy
+import os
 import time
 
 import config
+import events
 import log
 import algebra
 import map
+import timing
 
 
 PANEL_Y = config.SCREEN_HEIGHT - config.PANEL_HEIGHT
@@ -23,13 +27,51 @@ _con = None
 """ main console window for drawing the map and objects """
 _overlay = None
 """ buffer overlaid over the main console window for effects,
-labels, and other metadata.
+labels, and other metadata; composed from the OverlayLayers.
 """
+overlay_version = 0
+""" incremented whenever any OverlayLayer changes """
+_overlay_layers = {}
+""" name -> OverlayLayer """
 _panel = None
 """ UI text data """
+_drawn_panel = None
+""" _panel_state() _panel was last drawn for """
+_mouse_description = (None, '')
+""" (key, text) of the last description of the tile under the mouse """
+
+_map_layer = None
+""" offscreen console the size of the current map, showing every
+explored tile as remembered out of sight; the camera's window of it
+is copied into _con every frame.
+"""
+_layer_view = None
+""" (map, player elevation) _map_layer was drawn for """
+_layer_explored = None
+""" copy of the map's explored grid when _map_layer was last updated """
+_layer_terrain_version = None
+""" the map's terrain_version when _map_layer was last updated """
+_visible_view = None
+""" (map, camera x, camera y) _visible was computed for """
+_visible = set()
+""" map positions on screen and in FOV """
+_visible_xs = []
+_visible_ys = []
+""" _visible as x and y lists, for indexing arrays """
+_baked = {}
+""" player elevation -> (remembered, seen) buffers for the whole of _baked_map;
+see _baked_layers()
+"""
+_baked_map = None
+_baked_terrain_version = None
+""" _baked_map's terrain_version when _baked was last brought up to date """
+
 
 
 
+_console_pool = {}
+""" (width, height) -> list of offscreen consoles free for reuse """
+
 
 _console_center = algebra.Location(config.MAP_PANEL_WIDTH / 2,
                                    config.MAP_PANEL_HEIGHT / 2)
@@ -38,22 +80,10 @@ _console_center = algebra.Location(config.MAP_PANEL_WIDTH / 2,
 def block_for_key():
     """
     Approximately replacing libtcod.console_wait_for_keypress(),
-    returns a libtcod.Key object.
+    returns a libtcod.Key object; sleeps until a key other than
+    a modifier is pressed.
     """
-    key = libtcod.Key()
-    mouse = libtcod.Mouse()
-    while True:
-        libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS, key, mouse)
-        if (key.vk == libtcod.KEY_NONE):
-            continue
-
-        if (key.vk == libtcod.KEY_ALT or
-                key.vk == libtcod.KEY_SHIFT or
-                key.vk == libtcod.KEY_CONTROL):
-            continue
-
-        break
-    return key
+    return events.wait_for_key()
 
 
 class ScreenCoords(tuple):
@@ -75,24 +105,75 @@ class ScreenCoords(tuple):
         return algebra.Location(x, y)
 
 
-def renderer_init():
+def renderer_init(headless=False):
     """
     Initialize libtcod and set up our basic consoles to draw into.
+    If headless, the root console lives only in memory (SDL's dummy
+    video driver) and the frame rate is uncapped.
     """
     global _con, _panel, _overlay, _last_frame_time
+    if headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
     libtcod.console_set_custom_font('arial12x12.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
     # Map the dead space in the TCOD layout to [128...164]
     # libtcod.console_map_ascii_codes_to_font(256, 21, 11, 1)
     # libtcod.console_map_ascii_codes_to_font(277, 25, 0, 2)
     libtcod.console_map_ascii_code_to_font(129, 12, 1)
     libtcod.console_init_root(config.SCREEN_WIDTH, config.SCREEN_HEIGHT, 'Beyaz Dag', False)
-    libtcod.sys_set_fps(LIMIT_FPS)
+    if headless:
+        libtcod.sys_set_fps(0)
+    else:
+        libtcod.sys_set_fps(LIMIT_FPS)
     _con = libtcod.console_new(config.MAP_PANEL_WIDTH, config.MAP_PANEL_HEIGHT)
     _overlay = libtcod.console_new(config.MAP_PANEL_WIDTH, config.MAP_PANEL_HEIGHT)
+    libtcod.console_set_key_color(_overlay, libtcod.black)
     _panel = libtcod.console_new(config.SCREEN_WIDTH, config.PANEL_HEIGHT)
     _last_frame_time = time.time() * 1000
 
 
+def renderer_shutdown():
+    """
+    Delete the offscreen consoles the renderer has kept for reuse.
+    """
+    global _map_layer, _layer_view
+    if _map_layer is not None:
+        release_console(_map_layer)
+        _map_layer = None
+        _layer_view = None
+    for consoles in _console_pool.values():
+        for con in consoles:
+            libtcod.console_delete(con)
+    _console_pool.clear()
+
+
+def borrow_console(width, height):
+    """
+    Returns a blank offscreen console of the given size, with white on
+    black defaults; reuses one given back with release_console() if
+    there is one, rather than allocating another.
+    """
+    free = _console_pool.get((width, height))
+    if not free:
+        return libtcod.console_new(width, height)
+    con = free.pop()
+    libtcod.console_set_default_foreground(con, libtcod.white)
+    libtcod.console_set_default_background(con, libtcod.black)
+    libtcod.console_clear(con)
+    return con
+
+
+def release_console(con):
+    """
+    Give back a console from borrow_console(); the caller must not use it again.
+    """
+    size = (libtcod.console_get_width(con), libtcod.console_get_height(con))
+    _console_pool.setdefault(size, []).append(con)
+
+
+def pooled_console_count():
+    return sum(len(consoles) for consoles in _console_pool.values())
+
+
 def parse_move(key):
     """
     Returns (bool, direction, bool).
@@ -194,8 +275,10 @@ def finish_welcome():
 
 
 def clear_console():
-    global _con
+    global _con, _layer_view, _visible_view
     libtcod.console_clear(_con)
+    _layer_view = None
+    _visible_view = None
 
 
 def _render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
@@ -226,22 +309,40 @@ def _describe_obj(obj):
 
 
 def _get_names_under_mouse(player, (sx, sy)):
+    """
+    Returns describe_tile() of the map tile at screen position (sx, sy),
+    reusing the last description if nothing it depends on has changed.
+    """
+    global _mouse_description
     if (sx < 0 or sy < 0 or
             sx >= config.MAP_PANEL_WIDTH or
             sy >= config.MAP_PANEL_HEIGHT):
         return ''
 
-    objects = player.current_map.objects
-    fov_map = player.current_map.fov_map
+    current_map = player.current_map
     pos = ScreenCoords.toWorldCoords(player.camera_position,
                                      (sx, sy))
-    if (pos.x >= player.current_map.width or
-            pos.y >= player.current_map.height):
+    if (pos.x >= current_map.width or
+            pos.y >= current_map.height):
         return ''
 
-    names = [_describe_obj(obj) for obj in objects
-             if obj.pos == pos and
-             libtcod.map_is_in_fov(fov_map, obj.x, obj.y)]
+    key = (current_map, pos.x, pos.y, player.pos.x, player.pos.y,
+           player.turn_count, current_map.fov_generation,
+           current_map.tile_version(pos))
+    if key != _mouse_description[0]:
+        _mouse_description = (key, describe_tile(player, pos))
+    return _mouse_description[1]
+
+
+def describe_tile(player, pos):
+    """
+    Returns a description of the objects the player can see on map tile
+    (pos), its terrain, and (outdoors) its region and relative elevation.
+    """
+    in_fov = libtcod.map_is_in_fov(player.current_map.fov_map, pos.x, pos.y)
+    names = []
+    if in_fov:
+        names = [_describe_obj(obj) for obj in player.current_map.objects_at(pos)]
 
     names = ', '.join(names)
     names = names.capitalize()
@@ -254,21 +355,19 @@ def _get_names_under_mouse(player, (sx, sy)):
             names = ', '.join([names, tile_name])
 
     if player.current_map.is_outdoors:
-        player_region = player.current_map.region[player.pos.x][player.pos.y]
-        cursor_region = player.current_map.region[pos.x][pos.y]
-        region_type = player.current_map.region_terrain[cursor_region]
+        region_type = player.current_map.tile_region_terrain[pos.x, pos.y]
         if names == '':
             names = region_type
         else:
             names = ', '.join([names, region_type])
-        player_elevation = player.current_map.region_elevations[player_region]
-        viewed_elevation = player.current_map.region_elevations[cursor_region]
+        player_elevation = player.current_map.elevation(player.pos.x, player.pos.y)
+        viewed_elevation = player.current_map.elevation(pos.x, pos.y)
         if viewed_elevation < player_elevation:
             names += ' below you'
         elif viewed_elevation > player_elevation:
             names += ' above you'
 
-    if not libtcod.map_is_in_fov(fov_map, pos.x, pos.y):
+    if not in_fov:
         names += ' (out of sight)'
 
     # TEST
@@ -284,21 +383,6 @@ def _draw_object(player, o):
     libtcod.console_put_char(_con, x, y, o.char, libtcod.BKGND_NONE)
  
 
-def clear_object(player, o):
-    """
-    Erase the character that represents this object.
-    """
-    global _con
-    (x, y) = ScreenCoords.fromWorldCoords(player.camera_position, o.pos)
-    char = ' '
-    # qv _draw_fov_using_terrain(); doing this right may be ugly.
-    if player.current_map.is_outdoors:
-        if (player.current_map.elevation(o.pos.x, o.pos.y) <
-                player.current_map.elevation(player.pos.x, player.pos.y) - 1):
-            char = '#'
-    libtcod.console_put_char(_con, x, y, char, libtcod.BKGND_NONE)
-
-
 def menu(header, options, width):
     """
     Display a menu of options headed by letters; return (the key pressed, the index [0, 25] of the selection, or None).
@@ -313,10 +397,9 @@ def menu(header, options, width):
         header_height = 0
     height = len(options) + header_height
 
-    # Create an off-screen console that represents the menu's window.
-    window = libtcod.console_new(width, height)
+    # Borrow an off-screen console that represents the menu's window.
+    window = borrow_console(width, height)
 
-    libtcod.console_set_default_foreground(window, libtcod.white)
     libtcod.console_print_rect_ex(window, 0, 0, width, height, libtcod.BKGND_NONE, libtcod.LEFT, header)
 
     y = header_height
@@ -330,13 +413,10 @@ def menu(header, options, width):
     x = config.SCREEN_WIDTH/2 - width/2
     y = config.SCREEN_HEIGHT/2 - height/2
     libtcod.console_blit(window, 0, 0, width, height, 0, x, y, 1.0, 0.7)
+    release_console(window)
 
     libtcod.console_flush()
-    while True:
-        key = block_for_key()
-        if not (key.vk == libtcod.KEY_ALT or key.vk == libtcod.KEY_CONTROL or
-                key.vk == libtcod.KEY_SHIFT):
-            break
+    key = block_for_key()
 
     index = key.c - ord('a')
     if index >= 0 and index < len(options):
@@ -344,99 +424,319 @@ def menu(header, options, width):
     return (key.c, None)
 
 
-def _debug_region(current_map, screen_x, screen_y, pos):
-    global _con
-    libtcod.console_set_char(_con, screen_x, screen_y, chr(65 + (current_map.region[pos.x][pos.y] % 26)))
+class OverlayLayer(object):
+    """
+    A named set of cells drawn over the map, in screen coordinates.
+    Each cell has a background color and optionally a character and
+    its foreground color. Layers with higher order are drawn on top.
+    A black background is transparent.
+    """
+    def __init__(self, name, order):
+        self.name = name
+        self.order = order
+        self.cells = {}
+        self.dirty = False
 
+    def _changed(self):
+        global overlay_version
+        self.dirty = True
+        overlay_version += 1
 
-def _debug_elevation(current_map, screen_x, screen_y, pos):
-    global _con
-    libtcod.console_set_char(_con, screen_x, screen_y,
-                             chr(48 + current_map.region_elevations[current_map.region[pos.x][pos.y]]))
+    def set_cell(self, x, y, back, char=None, fore=libtcod.white):
+        self.cells[(x, y)] = (back, char, fore)
+        self._changed()
 
+    def clear_cell(self, x, y):
+        if self.cells.pop((x, y), None) is not None:
+            self._changed()
 
-def _draw_unseen(player, screen_x, screen_y, pos, terrain, icon):
-    global _con
+    def clear(self):
+        if self.cells:
+            self.cells = {}
+            self._changed()
+
+    def is_empty(self):
+        return not self.cells
+
+
+def overlay_layer(name, order=0):
+    """
+    Returns the OverlayLayer called (name), creating it if necessary.
+    """
+    layer = _overlay_layers.get(name)
+    if layer is None:
+        layer = OverlayLayer(name, order)
+        _overlay_layers[name] = layer
+    return layer
+
+
+def _debug_region(player):
+    """
+    Letter each tile on screen by its region (mod 26).
+    """
+    layer = overlay_layer('debug region')
+    layer.clear()
     current_map = player.current_map
-    sc = terrain.unseen_color
-    if not sc:
-        sc = map.region_colors_unseen[current_map.region_terrain[current_map.region[pos.x][pos.y]]]
-    libtcod.console_set_char_background(_con, screen_x, screen_y, sc, libtcod.BKGND_SET)
-    # _debug_region(current_map, screen_x, screen_y, pos)
-    if icon:
-        libtcod.console_set_char_foreground(_con, screen_x, screen_y, terrain.icon_color)
-        libtcod.console_set_char(_con, screen_x, screen_y, icon)
-    # else:
-    #     _debug_elevation(current_map, screen_x, screen_y, pos)
+    camera = player.camera_position
+    (width, height) = _view_size(current_map)
+    for screen_y in range(height):
+        for screen_x in range(width):
+            region = current_map.region[camera.x + screen_x, camera.y + screen_y]
+            layer.set_cell(screen_x, screen_y, libtcod.darkest_grey,
+                           chr(65 + region % 26))
 
 
-def _draw_outdoors(player):
+def _debug_elevation(player):
     """
-    Overly optimized: this code inlines Map.terrain_at(), Map.is_explored(),
-    and ScreenCoords.toWorldCoords() in order to get a 2.5x speedup on
-    large maps.
+    Number each tile on screen with its elevation.
     """
-    libtcod.console_clear(_con)
+    layer = overlay_layer('debug elevation')
+    layer.clear()
     current_map = player.current_map
-    pos = algebra.Location(0, 0)
-    player_elevation = current_map.region_elevations[current_map.region[player.pos.x][player.pos.y]]
-    for screen_y in range(min(current_map.height, config.MAP_PANEL_HEIGHT)):
-        pos.set(player.camera_position.x, player.camera_position.y + screen_y)
-        for screen_x in range(min(current_map.width, config.MAP_PANEL_WIDTH)):
-            visible = libtcod.map_is_in_fov(current_map.fov_map, pos.x, pos.y)
-            terrain = map.terrain_types[current_map.terrain[pos.x][pos.y]]
-            explored = current_map._explored[pos.x][pos.y]
-            current_elevation = current_map.region_elevations[current_map.region[pos.x][pos.y]]
-            icon = terrain.icon
-            if icon:
-                if terrain.name == 'slope' and current_elevation < player_elevation:
-                    icon = 'v'
-            # draw (player_elevation - 1) so that we can see up-slopes; lower than that just
-            # gets a colored fill
-            if (current_elevation + 1 < player_elevation):
-                if visible or explored:
-                    libtcod.console_put_char_ex(_con, screen_x, screen_y, '#',
-                        map.region_colors_seen[current_map.region_terrain[current_map.region[pos.x][pos.y]]],
-                        libtcod.black)
-                if visible:
-                    current_map.explore(pos)
-            elif not visible:
-                if explored:
-                    _draw_unseen(player, screen_x, screen_y, pos, terrain, icon)
-            else:
-                seen_color = terrain.seen_color
-                if not seen_color:
-                    seen_color = map.region_colors_seen[current_map.region_terrain[current_map.region[pos.x][pos.y]]]
-                libtcod.console_put_char_ex(_con, screen_x, screen_y, icon, terrain.icon_color, seen_color) 
-                current_map.explore(pos)
-            pos.x += 1
-
-
-def _draw_indoors(player):
-    """
-    Overly optimized: this code inlines Map.terrain_at(), Map.is_explored(),
-    and ScreenCoords.toWorldCoords() in order to get a 2.5x speedup on
-    large maps.
+    camera = player.camera_position
+    (width, height) = _view_size(current_map)
+    for screen_y in range(height):
+        for screen_x in range(width):
+            elevation = current_map.tile_elevation[camera.x + screen_x, camera.y + screen_y]
+            layer.set_cell(screen_x, screen_y, libtcod.darkest_grey,
+                           chr(48 + elevation))
+
+
+def _view_size(current_map):
+    return (min(current_map.width, config.MAP_PANEL_WIDTH),
+            min(current_map.height, config.MAP_PANEL_HEIGHT))
+
+
+def visible_tiles(player):
     """
-    libtcod.console_clear(_con)
+    Returns the set of (x, y) map positions on screen and in FOV.
+    Only the box within TORCH_RADIUS of the player is checked,
+    since nothing beyond it can be lit.
+    """
+    current_map = player.current_map
+    fov_map = current_map.fov_map
+    camera = player.camera_position
+    (width, height) = _view_size(current_map)
+    radius = config.TORCH_RADIUS
+    visible = set()
+    for x in range(max(player.pos.x - radius, camera.x),
+                   min(player.pos.x + radius + 1, camera.x + width)):
+        for y in range(max(player.pos.y - radius, camera.y),
+                       min(player.pos.y + radius + 1, camera.y + height)):
+            if libtcod.map_is_in_fov(fov_map, x, y):
+                visible.add((x, y))
+    return visible
+
+
+def _rgb_table(colors):
+    """
+    Returns an (n, 3) array of the components of (colors);
+    None becomes black, as it does when handed to libtcod.
+    """
+    return numpy.array([(c.r, c.g, c.b) if c is not None else (0, 0, 0)
+                        for c in colors], dtype=numpy.uint8)
+
+
+_terrain_icon = numpy.array([ord(t.icon) if t.icon else 0 for t in map.terrain_types])
+""" character code of each terrain type's icon, 0 if none """
+_terrain_icon_color = _rgb_table([t.icon_color for t in map.terrain_types])
+_terrain_seen_color = _rgb_table([t.seen_color for t in map.terrain_types])
+_terrain_unseen_color = _rgb_table([t.unseen_color for t in map.terrain_types])
+_terrain_has_seen_color = numpy.array([t.seen_color is not None for t in map.terrain_types])
+""" terrain types without their own colors take them from the region outdoors """
+_terrain_has_unseen_color = numpy.array([t.unseen_color is not None for t in map.terrain_types])
+_terrain_is_slope = numpy.array([t.name == 'slope' for t in map.terrain_types])
+
+
+def _region_rgb(current_map, colors, index):
+    """
+    Returns the color in the dict (colors) of the region terrain type
+    of each tile of the map at (index).
+    """
+    table = _rgb_table([colors.get(t) for t in current_map.region_terrain])
+    return table[current_map.region[index]]
+
+
+def _new_buffers(shape):
+    """
+    Returns (char, foreground, background) arrays of the given shape,
+    holding blank cells; for a console they're indexed [x, y].
+    """
+    return (numpy.full(shape, ord(' '), dtype=numpy.uint8),
+            numpy.zeros(shape + (3,), dtype=numpy.uint8),
+            numpy.zeros(shape + (3,), dtype=numpy.uint8))
+
+
+def _fill_console(con, (char, fore, back)):
+    """
+    Upload console-sized buffers to (con) in three calls;
+    libtcod wants flat arrays in row-major order.
+    """
+    libtcod.console_fill_char(con, char.T.ravel())
+    libtcod.console_fill_foreground(con, fore[:, :, 0].T.ravel(),
+                                    fore[:, :, 1].T.ravel(), fore[:, :, 2].T.ravel())
+    libtcod.console_fill_background(con, back[:, :, 0].T.ravel(),
+                                    back[:, :, 1].T.ravel(), back[:, :, 2].T.ravel())
+
+
+def _put_cells(con, origin, xs, ys, (char, fore, back)):
+    """
+    Copy the cells of map-sized buffers at map positions (xs, ys)
+    onto (con), whose top left corner is at map position (origin).
+    """
+    if len(xs) == 0:
+        return
+    for (x, y, c, f, b) in zip(xs, ys, char[xs, ys].tolist(),
+                               fore[xs, ys].tolist(), back[xs, ys].tolist()):
+        libtcod.console_put_char_ex(con, x - origin.x, y - origin.y, c,
+                                    libtcod.Color(*f), libtcod.Color(*b))
+
+
+def _pick(mask, a, b):
+    """
+    Per-tile choice between two color arrays.
+    """
+    return numpy.where(mask[..., None], a, b)
+
+
+def _bake_outdoors(current_map, player_elevation, index):
+    """
+    Returns (remembered, seen) buffers for the tiles of the map at (index)
+    as viewed from (player_elevation): how each is drawn when explored
+    but out of sight, and when in FOV.
+    """
+    terrain = current_map.terrain[index]
+    elevation = current_map.tile_elevation[index]
+    region_seen = _region_rgb(current_map, map.region_colors_seen, index)
+    region_unseen = _region_rgb(current_map, map.region_colors_unseen, index)
+    icon = numpy.where(_terrain_is_slope[terrain] & (elevation < player_elevation),
+                       ord('v'), _terrain_icon[terrain])
+    has_icon = icon != 0
+    icon_color = _terrain_icon_color[terrain]
+    black = numpy.zeros_like(icon_color)
+
+    # draw (player_elevation - 1) so that we can see up-slopes; lower than that just
+    # gets a colored fill
+    below = elevation + 1 < player_elevation
+    fill = numpy.full(terrain.shape, ord('#'), dtype=numpy.uint8)
+
+    remembered = (numpy.where(below, fill, numpy.where(has_icon, icon, ord(' '))),
+                  _pick(below, region_seen, _pick(has_icon, icon_color, black)),
+                  _pick(below, black, _pick(_terrain_has_unseen_color[terrain],
+                                            _terrain_unseen_color[terrain],
+                                            region_unseen)))
+    seen = (numpy.where(below, fill, icon),
+            _pick(below, region_seen, icon_color),
+            _pick(below, black, _pick(_terrain_has_seen_color[terrain],
+                                      _terrain_seen_color[terrain],
+                                      region_seen)))
+    return (remembered, seen)
+
+
+def _bake_indoors(current_map, player_elevation, index):
+    """
+    As _bake_outdoors(); indoors there's no elevation.
+    """
+    terrain = current_map.terrain[index]
+    (char, fore, back) = _new_buffers(terrain.shape)
+    remembered = (char, fore, _terrain_unseen_color[terrain])
+    seen = (_terrain_icon[terrain], _terrain_icon_color[terrain],
+            _terrain_seen_color[terrain])
+    return (remembered, seen)
+
+
+def _baked_layers(current_map, player_elevation):
+    """
+    Returns (remembered, seen) buffers for the whole map viewed from
+    (player_elevation), baking them the first time they're asked for.
+    Tiles whose terrain has changed since are rebaked for every
+    elevation in the cache.
+    """
+    global _baked, _baked_map, _baked_terrain_version
+    if current_map.is_outdoors:
+        bake = _bake_outdoors
+    else:
+        bake = _bake_indoors
+    if current_map is not _baked_map:
+        _baked = {}
+        _baked_map = current_map
+    elif current_map.terrain_version != _baked_terrain_version:
+        changed = current_map.terrain_changes_since(_baked_terrain_version)
+        for (elevation, layers) in _baked.items():
+            new_layers = bake(current_map, elevation, changed)
+            for (buffers, new_buffers) in zip(layers, new_layers):
+                for (array, new_array) in zip(buffers, new_buffers):
+                    array[changed] = new_array
+    _baked_terrain_version = current_map.terrain_version
+    if player_elevation not in _baked:
+        _baked[player_elevation] = bake(current_map, player_elevation, Ellipsis)
+    return _baked[player_elevation]
+
+
+def _update_layer(current_map, player_elevation, remembered):
+    """
+    Bring _map_layer up to date from the (remembered) buffers.
+    It's redrawn whole if the map or the player's elevation changed;
+    otherwise only tiles explored or whose terrain changed since the
+    last call are redrawn.
+    """
+    global _map_layer, _layer_view, _layer_explored, _layer_terrain_version
+    explored = current_map._explored
+    view = (current_map, player_elevation)
+    if view != _layer_view:
+        if (_map_layer is None or
+                libtcod.console_get_width(_map_layer) != current_map.width or
+                libtcod.console_get_height(_map_layer) != current_map.height):
+            if _map_layer is not None:
+                release_console(_map_layer)
+            _map_layer = borrow_console(current_map.width, current_map.height)
+        buffers = _new_buffers(explored.shape)
+        for (array, baked) in zip(buffers, remembered):
+            array[explored] = baked[explored]
+        _fill_console(_map_layer, buffers)
+    else:
+        changed = explored != _layer_explored
+        if current_map.terrain_version != _layer_terrain_version:
+            changed[current_map.terrain_changes_since(_layer_terrain_version)] = True
+        (xs, ys) = numpy.nonzero(changed & explored)
+        if len(xs) == 0:
+            return
+        _put_cells(_map_layer, algebra.Location(0, 0), xs.tolist(), ys.tolist(),
+                   remembered)
+
+    _layer_view = view
+    _layer_explored = explored.copy()
+    _layer_terrain_version = current_map.terrain_version
+
+
+def _draw_map(player):
+    """
+    Bring the map console up to date, before objects are drawn on it:
+    copy the camera's window of _map_layer, then draw the tiles in FOV
+    over it. The set of tiles in FOV is only recomputed if FOV or the
+    camera changed.
+    """
+    global _visible_view, _visible, _visible_xs, _visible_ys
     current_map = player.current_map
-    pos = algebra.Location(0, 0)
-    for screen_y in range(min(current_map.height, config.MAP_PANEL_HEIGHT)):
-        pos.set(player.camera_position.x, player.camera_position.y + screen_y)
-        for screen_x in range(min(current_map.width, config.MAP_PANEL_WIDTH)):
-            # pos = ScreenCoords.toWorldCoords(player.camera_position, (screen_x, screen_y))
-            visible = libtcod.map_is_in_fov(current_map.fov_map, pos.x, pos.y)
-            # terrain = current_map.terrain_at(pos)
-            terrain = map.terrain_types[current_map.terrain[pos.x][pos.y]]
-            if not visible:
-                # if current_map.is_explored(pos):
-                if current_map._explored[pos.x][pos.y]:
-                    libtcod.console_set_char_background(_con, screen_x, screen_y,
-                                                        terrain.unseen_color, libtcod.BKGND_SET)
-            else:
-                libtcod.console_put_char_ex(_con, screen_x, screen_y, terrain.icon, terrain.icon_color, terrain.seen_color)
-                current_map.explore(pos)
-            pos.x += 1
+    camera = player.camera_position
+    (width, height) = _view_size(current_map)
+    player_elevation = current_map.elevation(player.pos.x, player.pos.y)
+
+    visible_view = (current_map, camera.x, camera.y, current_map.fov_generation)
+    if visible_view != _visible_view:
+        _visible = visible_tiles(player)
+        _visible_view = visible_view
+        _visible_xs = [x for (x, y) in _visible]
+        _visible_ys = [y for (x, y) in _visible]
+    # Anything in sight is explored before the layer is brought up to date,
+    # so it's remembered as soon as it leaves FOV.
+    if _visible:
+        current_map._explored[_visible_xs, _visible_ys] = True
+
+    (remembered, seen) = _baked_layers(current_map, player_elevation)
+    _update_layer(current_map, player_elevation, remembered)
+    libtcod.console_blit(_map_layer, camera.x, camera.y, width, height, _con, 0, 0)
+    _put_cells(_con, camera, _visible_xs, _visible_ys, seen)
 
 
 def update_camera(player):
@@ -451,9 +751,7 @@ def update_camera(player):
                  player.current_map.width - config.MAP_PANEL_WIDTH,
                  player.current_map.height - config.MAP_PANEL_HEIGHT))
 
-    if newPos != player.camera_position:
-        player.current_map.fov_needs_recompute = True
-        player.camera_position = newPos
+    player.camera_position = newPos
 
 
 def _debug_positions(player, mouse):
@@ -496,6 +794,23 @@ def _debug_fps():
                              'FPS ' + str(20000. / _twenty_frame_estimate))
 
 
+def _draw_timing_hud():
+    """
+    Show the phase timings of the last complete frame in the top right
+    corner of the map.
+    """
+    frame = timing.last_frame()
+    if frame is None:
+        return
+    x = config.MAP_PANEL_WIDTH - 1
+    y = 0
+    libtcod.console_set_default_foreground(0, libtcod.light_gray)
+    for (phase, ms) in frame.items():
+        libtcod.console_print_ex(0, x, y, libtcod.BKGND_SET, libtcod.RIGHT,
+                                 '%s %6.1f' % (phase, ms))
+        y += 1
+
+
 def draw_console(player):
     """
     Refreshes the map display and blits to the window.
@@ -505,27 +820,27 @@ def draw_console(player):
 
     current_map = player.current_map
 
-    if current_map.is_outdoors and current_map.fov_elevation_changed:
-        current_map.set_fov_elevation(player)
-        current_map.fov_elevation_changed = False
-
-    if current_map.fov_needs_recompute:
-        libtcod.map_compute_fov(
-            player.current_map.fov_map, player.x,
-            player.y, config.TORCH_RADIUS, config.FOV_LIGHT_WALLS, config.FOV_ALGO)
-        # Redraw if FOV (could have) changed.
-        if current_map.is_outdoors:
-            _draw_outdoors(player)
-        else:
-            _draw_indoors(player)
+    # FOV itself is brought up to date by the main loop, before rendering.
+    started = timing.start()
+    _draw_map(player)
+    timing.record('draw map', started)
 
     # Draw all objects in the list, except the player. We want it to
     # always appear over all other objects, so it's drawn later.
     # (Could also achieve this by guaranteeing the player is always
     # the last object in current_map.objects.)
-    for object in player.visible_objects:
-        _draw_object(player, object)
-    _draw_object(player, player)
+    started = timing.start()
+    (width, height) = _view_size(current_map)
+    for object in player.visible_objects + [player]:
+        screen_x = object.pos.x - player.camera_position.x
+        screen_y = object.pos.y - player.camera_position.y
+        if (screen_x >= 0 and screen_y >= 0 and
+                screen_x < width and screen_y < height):
+            _draw_object(player, object)
+    timing.record('draw objects', started)
+
+    # _debug_region(player)
+    # _debug_elevation(player)
 
     libtcod.console_blit(_con, 0, 0, config.MAP_PANEL_WIDTH,
                          config.MAP_PANEL_HEIGHT, 0, 0, 0)
@@ -537,15 +852,39 @@ def _pwrite(line, string, color=libtcod.white):
     libtcod.console_print_ex(_panel, 1, line, libtcod.BKGND_NONE, libtcod.LEFT, string)
 
 
+def _panel_state(player, names):
+    """
+    Everything draw_panel() shows.
+    """
+    fighter = player.fighter
+    return (log.version, fighter.max_hp, fighter.wounds, fighter.hp,
+            fighter.bleeding, fighter.exhaustion / 100, player.current_map,
+            player.pos.x, player.pos.y, player.turn_count, names)
+
+
 def draw_panel(player, pointer_location):
     """
-    Refreshes the UI display and blits it to the window.
+    Refreshes the UI display and blits it to the window;
+    _panel is only redrawn if something on it changed.
     """
+    global _drawn_panel
+    names = _get_names_under_mouse(player, pointer_location)
+    state = _panel_state(player, names)
+    if state != _drawn_panel:
+        _draw_panel(player, names)
+        _drawn_panel = state
+
+    # Done with "_panel", blit it to the root console.
+    libtcod.console_blit(_panel, 0, 0, config.SCREEN_WIDTH, config.PANEL_HEIGHT,
+                         0, 0, PANEL_Y)
+
+
+def _draw_panel(player, names):
     libtcod.console_set_default_background(_panel, libtcod.black)
     libtcod.console_clear(_panel)
 
     # Only display the (log.MSG_HEIGHT) most recent
-    write_log(log.game_msgs[-log.MSG_HEIGHT:], _panel, MSG_X, 1)
+    write_log(log.recent(log.MSG_HEIGHT), _panel, MSG_X, 1)
 
     _render_bar(1, 1, config.BAR_WIDTH, 'HP', int(player.fighter.max_hp - player.fighter.wounds),
                 player.fighter.max_hp,
@@ -567,7 +906,7 @@ def draw_panel(player, pointer_location):
     if player.current_map.is_outdoors:
         _pwrite(line,
                 'Elevation: ' +
-                str(player.current_map.region_elevations[player.current_map.region[player.pos.x][player.pos.y]] * 500) +
+                str(player.current_map.elevation(player.pos.x, player.pos.y) * 500) +
                 ' feet')
         line += 1
     elif hasattr(player.current_map, 'dungeon_level'):
@@ -583,17 +922,34 @@ def draw_panel(player, pointer_location):
 
     libtcod.console_set_default_foreground(_panel, libtcod.light_gray)
     libtcod.console_print_ex(
-        _panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT,
-        _get_names_under_mouse(player, pointer_location))
+        _panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, names)
 
-    # Done with "_panel", blit it to the root console.
-    libtcod.console_blit(_panel, 0, 0, config.SCREEN_WIDTH, config.PANEL_HEIGHT,
-                         0, 0, PANEL_Y)
+
+def _compose_overlay(layers):
+    """
+    Redraw _overlay from (layers), bottom to top.
+    """
+    libtcod.console_set_default_background(_overlay, libtcod.black)
+    libtcod.console_clear(_overlay)
+    for layer in sorted(layers, key=lambda l: l.order):
+        for ((x, y), (back, char, fore)) in layer.cells.items():
+            libtcod.console_set_char_background(_overlay, x, y, back, libtcod.BKGND_SET)
+            if char is not None:
+                libtcod.console_set_char_foreground(_overlay, x, y, fore)
+                libtcod.console_set_char(_overlay, x, y, char)
+        layer.dirty = False
 
 
 def blit_overlay():
-    global _overlay
-    libtcod.console_set_key_color(_overlay, libtcod.black)
+    """
+    Blit the overlay layers onto the screen; _overlay is only recomposed
+    if a layer changed, and nothing is blitted if they're all empty.
+    """
+    layers = _overlay_layers.values()
+    if any(layer.dirty for layer in layers):
+        _compose_overlay(layers)
+    if all(layer.is_empty() for layer in layers):
+        return
     libtcod.console_blit(_overlay, 0, 0, config.MAP_PANEL_WIDTH,
                          config.MAP_PANEL_HEIGHT, 0, 0, 0, 0.4, 1.0)
 
@@ -614,5 +970,39 @@ def render_all(player, pointer_location):
         _last_frame_time = now
 
     draw_console(player)
+    started = timing.start()
     draw_panel(player, pointer_location)
+    timing.record('draw panel', started)
+    started = timing.start()
     blit_overlay()
+    timing.record('blit overlay', started)
+    if timing.show_hud:
+        _draw_timing_hud()
+
+
+def _test_fill_console():
+    """
+    Require that _fill_console() puts every cell where it belongs,
+    reading them back one at a time.
+    """
+    (width, height) = (7, 5)
+    buffers = _new_buffers((width, height))
+    (char, fore, back) = buffers
+    for x in range(width):
+        for y in range(height):
+            char[x, y] = ord('a') + (x + y * width) % 26
+            fore[x, y] = (x, y, 200)
+            back[x, y] = (100, x * 10, y * 10)
+    con = libtcod.console_new(width, height)
+    _fill_console(con, buffers)
+    for x in range(width):
+        for y in range(height):
+            assert libtcod.console_get_char(con, x, y) == char[x, y]
+            assert libtcod.console_get_char_foreground(con, x, y) == libtcod.Color(x, y, 200)
+            assert libtcod.console_get_char_background(con, x, y) == libtcod.Color(100, x * 10, y * 10)
+    libtcod.console_delete(con)
+
+
+if __name__ == '__main__':
+    _test_fill_console()
+    print('Renderer tests complete.')
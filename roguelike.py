@@ -2,28 +2,37 @@
 # Copyright 2016 Thomas C. Hudson
 # Governed by the license described in LICENSE.txt
 import sys
+import time
 
 import libtcodpy as libtcod
 import shelve
 import cProfile
 
 import config
+import events
 import log
 import algebra
 from components import *
 import renderer
 import interface
+import timing
 import miscellany
 import actions
 import ai
 import spells
 import quest
+import scheduler
 import dungeon_cartographer
 import mountain_cartographer
 
 INVENTORY_WIDTH = 50
 CHARACTER_SCREEN_WIDTH = 30
 
+# While idle the main loop slows down towards this frame rate...
+IDLE_LIMIT_FPS = 8
+# ...but redraws at least this often anyway.
+IDLE_REDRAW_SECONDS = 1.
+
 
 class Skill(object):
     def __init__(self, name, cost, description):
@@ -79,8 +88,8 @@ def try_fire(player):
 
 
 def try_pick_up(player):
-    for object in player.current_map.objects:
-        if object.x == player.x and object.y == player.y and object.item:
+    for object in player.current_map.objects_at(player.pos):
+        if object.item:
             return actions.pick_up(player, object)
     return False
 
@@ -169,6 +178,7 @@ def display_help():
                     '</traverse stairs\n' +
                     '\n' +
                     'control-p/scroll through old log messages\n' +
+                    'F2/show frame timings, F3/save them to a file\n' +
                     'mouse over objects to look at them\n',
                     INVENTORY_WIDTH)
 
@@ -187,8 +197,8 @@ def player_move_or_attack(player, direction, try_running):
 
     # Is there an attackable object?
     target_obj = None
-    for obj in player.current_map.objects:
-        if obj.fighter and obj.pos == goal:
+    for obj in player.current_map.objects_at(goal):
+        if obj.fighter:
             target_obj = obj
             break
     if target_obj is not None:
@@ -200,8 +210,8 @@ def player_move_or_attack(player, direction, try_running):
 
     # Is there an interactable object?
     target_obj = None
-    for obj in player.current_map.objects:
-        if obj.interactable and obj.pos == goal:
+    for obj in player.current_map.objects_at(goal):
+        if obj.interactable:
             target_obj = obj
             break
     if target_obj is not None:
@@ -214,8 +224,7 @@ def player_move_or_attack(player, direction, try_running):
         if player.current_map.xp_visit:
             player.current_map.xp_visit(player.current_map, player)
         if player.current_map.is_outdoors:
-            new_region = player.current_map.region[player.pos.x][player.pos.y]
-            new_elevation = player.current_map.region_elevations[new_region]
+            new_elevation = player.current_map.elevation(player.pos.x, player.pos.y)
             if new_elevation != elevation_before_moving:
                 player.current_map.fov_elevation_changed = True
                 player.fighter.exhaustion += actions.CLIMB_EXHAUSTION
@@ -225,9 +234,9 @@ def player_move_or_attack(player, direction, try_running):
         # Automatically sweep up ammunition after a shooting spree
         ammo_eq = actions.get_equipped_in_slot(player, 'quiver')
         if ammo_eq:
-            for obj in player.current_map.objects:
-                if (obj.pos == player.pos and obj.item and 
-                        obj.item.can_combine(ammo_eq.owner)):
+            # pick_up() edits the tile's list, so iterate over a copy
+            for obj in list(player.current_map.objects_at(player.pos)):
+                if obj.item and obj.item.can_combine(ammo_eq.owner):
                     actions.pick_up(player, obj)
         return True
 
@@ -280,11 +289,10 @@ def _running_lookahead(player):
             (map.terrain_at(player.pos + dir.left.left) != map.terrain_at(player.pos + dir.left)) or
             (map.terrain_at(player.pos + dir.right.right) != map.terrain_at(player.pos + dir.right))):
         return True
-    for o in map.objects:
-        if (o.pos == player.pos + dir or
-                o.pos == player.pos + dir.left or
-                o.pos == player.pos + dir.right):
-            return True
+    if (map.objects_at(player.pos + dir) or
+            map.objects_at(player.pos + dir.left) or
+            map.objects_at(player.pos + dir.right)):
+        return True
     return False
 
 
@@ -299,6 +307,15 @@ def handle_keys(player, key):
         # Alt+Enter: toggle fullscreen
         libtcod.console_set_fullscreen(not libtcod.console_is_fullscreen())
 
+    elif key.vk == libtcod.KEY_F2:
+        timing.show_hud = not timing.show_hud
+        return 'didnt-take-turn'
+
+    elif key.vk == libtcod.KEY_F3:
+        timing.dump()
+        log.message('Saved frame timings to ' + timing.DUMP_FILE + '.')
+        return 'didnt-take-turn'
+
     elif key.vk == libtcod.KEY_ESCAPE:
         return 'exit'
 
@@ -387,7 +404,8 @@ def save_game(player):
     Save the game to file "savegame";
     overwrites any existing data.
     """
-    file = shelve.open('savegame', 'n')
+    # Binary pickling keeps the numpy map grids compact.
+    file = shelve.open('savegame', 'n', protocol=2)
     file['current_map'] = player.current_map
     file['player_index'] = player.current_map.objects.index(player)
     file['game_msgs'] = log.game_msgs
@@ -402,13 +420,12 @@ def load_game():
     file = shelve.open('savegame', 'r')
     current_map = file['current_map']
     player = current_map.objects[file['player_index']]
-    log.game_msgs = file['game_msgs']
+    log.init(config.LOG_HISTORY_FILE)
+    log.restore(file['game_msgs'])
     file.close()
 
     current_map.initialize_fov()
-    libtcod.map_compute_fov(
-        player.current_map.fov_map, player.x,
-        player.y, config.TORCH_RADIUS, config.FOV_LIGHT_WALLS, config.FOV_ALGO)
+    player.current_map.compute_fov(player.pos)
 
     return player
 
@@ -447,7 +464,7 @@ def new_game():
     Returns the player object.
     """
     # Must initialize the log before we do anything that might emit a message.
-    log.init()
+    log.init(config.LOG_HISTORY_FILE)
     quest.display_welcome()
 
     player = Object(None, '@', 'player', libtcod.white, blocks=True,
@@ -502,9 +519,7 @@ def new_game():
     # actions.add_to_map(player.current_map, player.pos, miscellany.sword())
     # actions.add_to_map(player.current_map, player.pos, miscellany.roundshield())
 
-    libtcod.map_compute_fov(
-        player.current_map.fov_map, player.x,
-        player.y, config.TORCH_RADIUS, config.FOV_LIGHT_WALLS, config.FOV_ALGO)
+    player.current_map.compute_fov(player.pos)
 
     return player
 
@@ -517,6 +532,7 @@ def next_level(player, portal):
     """
     actions.heal(player.fighter, player.fighter.max_hp / 2)
     old_map = player.current_map
+    old_map.left_turn = player.turn_count
     generator = portal.generator
     need_stairs = generator(player, player.current_map.dungeon_level + 1)
     renderer.clear_console()
@@ -526,7 +542,7 @@ def next_level(player, portal):
         stairs = Object(player.pos, '>', 'stairs up', libtcod.white, always_visible=True)
         stairs.destination = old_map
         stairs.dest_position = portal.pos
-        player.current_map.objects.insert(0, stairs)
+        player.current_map.add_object(stairs)
         player.current_map.portals.insert(0, stairs)
 
     return player.current_map
@@ -537,12 +553,14 @@ def revisit_level(player, portal):
     Return to a level the player has previously visited (changing player.current_map).
     Does *not* heal the player.
     """
+    player.current_map.left_turn = player.turn_count
     player.current_map = portal.destination
     player.pos = portal.dest_position
     # Call to initialize_fov() should be redundant but in practice seems to have
     # worked around an intermittent bug.
     player.current_map.initialize_fov()
     player.current_map.fov_needs_recompute = True
+    scheduler.catch_up(player.current_map, player)
     renderer.update_camera(player)
     renderer.clear_console()
 
@@ -567,55 +585,179 @@ def process_visible_objects(player):
     return visible_objects
 
 
+def update_fov(player):
+    """
+    Apply any pending change of viewing elevation, and recompute FOV
+    if the player's surroundings changed. The renderer notices from
+    fov_generation that it needs to redraw.
+    """
+    current_map = player.current_map
+    started = timing.start()
+    if current_map.is_outdoors and current_map.fov_elevation_changed:
+        # Also recomputes FOV.
+        current_map.set_fov_elevation(player)
+        current_map.fov_elevation_changed = False
+    elif current_map.fov_needs_recompute:
+        current_map.compute_fov(player.pos)
+    timing.record('fov', started)
+
+
+def play_turn(player, key):
+    """
+    Everything in one pass of the main loop that follows input:
+    the player's action, then (if it took a turn) AI and bleeding.
+    Returns the result of handle_keys().
+    """
+    started = timing.start()
+    player_action = handle_keys(player, key)
+    timing.record('player', started)
+    if player_action == 'exit':
+        return player_action
+
+    # Recompute FOV *here*, not during rendering the way the tutorial did,
+    # so that monsters can react to the player's movement!
+    # This is a d'oh! sort of issue, because FOV is about gameplay, not
+    # just about rendering.
+    update_fov(player)
+
+    if (player_action != 'didnt-take-turn' and
+            (player.game_state == 'playing' or
+             player.game_state == 'running' or
+             player.game_state == 'shooting')):
+        scheduler.take_turns(player)
+        player.turn_count += 1
+        if player.fighter.inebriation > 0:
+            player.fighter.inebriation -= 1
+    return player_action
+
+
+def _frame_state(player, mouse):
+    """
+    Everything outside input that the main loop redraws for;
+    the camera follows the player's position.
+    """
+    current_map = player.current_map
+    return (current_map, player.pos.x, player.pos.y, player.turn_count,
+            player.game_state, current_map.fov_generation,
+            current_map.fov_elevation_changed, log.version,
+            renderer.overlay_version, mouse.cx, mouse.cy)
+
+
+def _idle_delay(idle_frames):
+    """
+    Milliseconds to sleep after (idle_frames) consecutive idle frames;
+    ramps from the active frame time to the idle one over about a second.
+    """
+    active = 1000 / renderer.LIMIT_FPS
+    idle = 1000 / IDLE_LIMIT_FPS
+    return min(idle, active + (idle - active) * idle_frames / renderer.LIMIT_FPS)
+
+
 def play_game(player):
     """
     Main loop.
+    A frame is only drawn if there was input in the previous one or
+    _frame_state() has changed since the last frame drawn; otherwise
+    the loop sleeps, longer the longer it stays idle.
     """
     player_action = None
+    had_input = True
+    drawn_state = None
+    drawn_time = 0
+    idle_frames = 0
 
     while not libtcod.console_is_window_closed():
         (key, mouse) = interface.poll()
-        player.visible_objects = process_visible_objects(player)
-        renderer.render_all(player, (mouse.cx, mouse.cy))
-        player.current_map.fov_needs_recompute = False
-
-        libtcod.console_flush()
-
-        # Erase all objects at their old locations, before they move.
-        for object in player.current_map.objects:
-            renderer.clear_object(player, object)
+        if (had_input or _frame_state(player, mouse) != drawn_state or
+                time.time() - drawn_time > IDLE_REDRAW_SECONDS):
+            timing.begin_frame()
+            update_fov(player)
+            started = timing.start()
+            player.visible_objects = process_visible_objects(player)
+            timing.record('visible objects', started)
+            renderer.render_all(player, (mouse.cx, mouse.cy))
+
+            started = timing.start()
+            libtcod.console_flush()
+            timing.record('flush', started)
+            drawn_state = _frame_state(player, mouse)
+            drawn_time = time.time()
+            idle_frames = 0
+        else:
+            idle_frames += 1
+            libtcod.sys_sleep_milli(_idle_delay(idle_frames))
 
-        player_action = handle_keys(player, key)
+        # Keypresses are acted on after the frame is drawn, so the
+        # frame after one is always drawn too.
+        had_input = key.vk != libtcod.KEY_NONE
+        player_action = play_turn(player, key)
         if player_action == 'exit':
             save_game(player)
+            log.close()
             break
 
-        # Recompute FOV *here*, not during rendering the way the tutorial did,
-        # so that monsters can react to the player's movement!
-        # This is a d'oh! sort of issue, because FOV is about gameplay, not
-        # just about rendering.
-        if player.current_map.fov_needs_recompute:
-            libtcod.map_compute_fov(
-                player.current_map.fov_map, player.x,
-                player.y, config.TORCH_RADIUS, config.FOV_LIGHT_WALLS, config.FOV_ALGO)
-
-        if (player_action != 'didnt-take-turn' and
-                (player.game_state == 'playing' or
-                 player.game_state == 'running' or
-                 player.game_state == 'shooting')):
-            for object in player.current_map.objects:
-                if object.ai:
-                    object.ai.take_turn(player)
-                if object.fighter and object.fighter.bleeding > 0:
-                    # this will also include the player
-                    actions.bleed(object)
-            player.turn_count += 1
-            if player.fighter.inebriation > 0:
-                player.fighter.inebriation -= 1
+
+def play_headless(player, keys, render=False):
+    """
+    Main loop without a window: play through the libtcod.Key list
+    (keys) as fast as possible, until it runs out, the player presses
+    Escape, or the player dies. Doesn't save the game.
+    If render, every frame is still drawn to the in-memory consoles;
+    otherwise nothing is drawn except by menus the script opens.
+    Requires renderer.renderer_init(headless=True).
+    Returns the number of frames run.
+    """
+    events.set_script(keys)
+    frames = 0
+    try:
+        while not events.script_done() and player.game_state != 'dead':
+            if player.game_state == 'running':
+                # Running continues until a key arrives; in live play
+                # that's the empty frames between keypresses.
+                key = libtcod.Key()
+                mouse = libtcod.Mouse()
+            else:
+                (key, mouse) = interface.poll()
+            timing.begin_frame()
+            update_fov(player)
+            started = timing.start()
+            player.visible_objects = process_visible_objects(player)
+            timing.record('visible objects', started)
+            if render:
+                renderer.render_all(player, (mouse.cx, mouse.cy))
+            frames += 1
+            if play_turn(player, key) == 'exit':
+                break
+    except events.ScriptExhausted:
+        # A menu or prompt wanted more input than the script had.
+        pass
+    finally:
+        events.set_script(None)
+    return frames
+
+
+def _headless_main(script):
+    """
+    python roguelike.py --headless KEYS
+    Plays a new game from the characters of KEYS without opening a window.
+    """
+    renderer.renderer_init(headless=True)
+    # One key to dismiss the welcome screen.
+    events.set_script([events.key(' ')])
+    player = new_game()
+    start = time.time()
+    frames = play_headless(player, events.keys_from_string(script))
+    print(str(frames) + ' frames, ' + str(player.turn_count) + ' turns in ' +
+          str(time.time() - start) + ' s')
+    renderer.renderer_shutdown()
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--headless':
+        _headless_main(sys.argv[2])
+        sys.exit()
     renderer.renderer_init()
     # cProfile.run('renderer.main_menu(new_game, play_game, load_game)')
     renderer.main_menu(new_game, play_game, load_game)
+    renderer.renderer_shutdown()
     sys.exit()
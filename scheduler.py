@@ -0,0 +1,245 @@
+"""
+Choosing which objects act, and when.
+
+Each map keeps a timeline: a heap of the objects due to act, keyed by
+  the time they next act, in ticks; an ordinary action takes
+  TICKS_PER_TURN, and longer for a fighter with an action_penalty from
+  wounds, bleeding, exhaustion or drink.
+scheduler.take_turns(player) runs the map's clock forward over the
+  player's action, giving a turn to everything that comes due: AIs act
+  and bleeding fighters bleed for the time since they last did.
+  A slowed player gives monsters more than one action per turn.
+Only awake objects are on the timeline, so a turn costs in proportion
+  to the number of actors due, not to the number of monsters on the map.
+  A dormant monster is woken by
+  - coming within TORCH_RADIUS of the player along both axes, the box
+    around everything the player's FOV can reach;
+  - being attacked (actions calls map.wake());
+  - the player entering its region or room.
+It goes back to sleep after a turn that its AI both starts and ends
+  inactive, unless it's bleeding. Removed and dead objects are dropped
+  from the timeline when they come due.
+Maps the player isn't on stand still. scheduler.catch_up(map, player)
+  makes up for the turns since the player left in one coarse step.
+"""
+# Copyright 2016 Thomas C. Hudson
+# Governed by the license described in LICENSE.txt
+import config
+import actions
+import ai
+import timing
+
+TICKS_PER_TURN = 100
+# Percentage slowdown for each point of action_penalty.
+SLOWDOWN_PER_PENALTY = 5
+
+_area = None
+""" (map, region or room) the player was in last turn """
+
+
+def action_ticks(obj):
+    """
+    Returns how long (obj) takes to act.
+    """
+    penalty = 0
+    if obj.fighter:
+        penalty = max(int(obj.fighter.action_penalty), 0)
+    return TICKS_PER_TURN * (100 + SLOWDOWN_PER_PENALTY * penalty) / 100
+
+
+def _area_at(current_map, pos):
+    """
+    Returns the region (outdoors) or room (indoors) at (pos); -1 for none.
+    """
+    if current_map.is_outdoors:
+        return current_map.region[pos.x, pos.y]
+    return current_map.room[pos.x, pos.y]
+
+
+def _wake_area(player):
+    """
+    Wake every monster in the player's region or room, if it's new.
+    """
+    global _area
+    current_map = player.current_map
+    area = _area_at(current_map, player.pos)
+    if _area == (current_map, area):
+        return
+    _area = (current_map, area)
+    if area < 0:
+        return
+    for obj in current_map.objects:
+        if obj.ai and _area_at(current_map, obj.pos) == area:
+            current_map.wake(obj)
+
+
+def _is_dormant(obj):
+    metadata = obj.ai._metadata
+    return metadata is not None and metadata.is_dormant()
+
+
+def _act(obj, player, ticks):
+    """
+    Give (obj) its turn, (ticks) after its last one; no time has
+    passed for an object that's just been woken.
+    Returns true if it should stay on the timeline.
+    """
+    busy = False
+    if obj.ai:
+        was_dormant = _is_dormant(obj)
+        started = timing.start()
+        obj.ai.take_turn(player)
+        timing.record('ai', started)
+        # Fleeing monsters need one inactive turn to calm down.
+        busy = obj.ai is not None and not (was_dormant and _is_dormant(obj))
+    if obj.fighter and obj.fighter.bleeding > 0:
+        # this will also include the player
+        started = timing.start()
+        actions.bleed(obj, float(ticks) / TICKS_PER_TURN)
+        timing.record('bleeding', started)
+        busy = busy or (obj.fighter is not None and obj.fighter.bleeding > 0)
+    return busy
+
+
+def take_turns(player):
+    """
+    Wake everything near the player, then advance the clock by the
+    player's action, giving a turn to each object that comes due.
+    Objects with nothing left to do are put back to sleep.
+    """
+    current_map = player.current_map
+    if player.fighter.bleeding > 0:
+        current_map.wake(player)
+    for obj in current_map.objects_near(player.pos, config.TORCH_RADIUS):
+        if obj.ai:
+            current_map.wake(obj)
+    _wake_area(player)
+
+    end = current_map.time + action_ticks(player)
+    while True:
+        due = current_map.pop_due(end)
+        if due is None:
+            break
+        (when, obj) = due
+        ticks = when - current_map.last_acted.pop(obj, when)
+        if _act(obj, player, ticks) and obj.current_map is current_map:
+            current_map.last_acted[obj] = when
+            current_map.schedule(obj, when + action_ticks(obj))
+    current_map.time = end
+
+
+def catch_up(current_map, player):
+    """
+    Advance (current_map) over the turns since the player left it, all at
+    once rather than turn by turn: fighters bleed for the whole time, and
+    each monster's AI passes it as ai.pass_time() describes.
+    """
+    if current_map.left_turn is None:
+        return
+    turns = player.turn_count - current_map.left_turn
+    current_map.left_turn = None
+    if turns <= 0:
+        return
+    for obj in list(current_map.objects):
+        if obj is player or not obj.fighter:
+            continue
+        if obj.fighter.bleeding > 0:
+            actions.bleed(obj, turns)
+        if obj.ai:
+            ai.pass_time(obj, turns)
+
+
+def _test_slowed_player():
+    """
+    Require that a monster acts twice for each action of a player slowed
+    to half speed, and that a removed monster is dropped.
+    """
+    import algebra
+    import map
+    from components import Object, Fighter, AI
+
+    new_map = map.DungeonMap(10, 10, 1)
+    player = Object(algebra.Location(1, 1), '@', 'player', None, fighter=Fighter(100))
+    player.fighter.wounds = 40
+    moves = []
+    monster = Object(algebra.Location(5, 5), 'm', 'monster', None,
+                     ai=AI(lambda monster, player, metadata: moves.append(monster)))
+    for obj in (player, monster):
+        obj.current_map = new_map
+        new_map.add_object(obj)
+
+    assert action_ticks(player) == 2 * TICKS_PER_TURN
+    take_turns(player)
+    assert len(moves) == 2
+    take_turns(player)
+    assert len(moves) == 4
+    new_map.remove_object(monster)
+    take_turns(player)
+    assert len(moves) == 4
+
+
+def _test_catch_up():
+    """
+    Require that catching up a map hands a confused monster back its old AI,
+    calms a fleeing one down, keeps a wandering one in bounds on open floor,
+    and lets a bleeding one bleed out.
+    """
+    import algebra
+    import map
+    from components import Object, Fighter, AI
+
+    new_map = map.DungeonMap(10, 10, 1)
+    new_map.terrain[1:9, 1:9] = map.TERRAIN_FLOOR
+    player = Object(algebra.Location(8, 8), '@', 'player', None, fighter=Fighter(100))
+    player.current_map = new_map
+    new_map.add_object(player)
+
+    def monster(x, y, turn_function, metadata):
+        obj = Object(algebra.Location(x, y), 'm', 'monster', None, blocks=True,
+                     fighter=Fighter(10), ai=AI(turn_function, metadata))
+        obj.current_map = new_map
+        new_map.add_object(obj)
+        return obj
+
+    confused = monster(4, 4, ai.ignoring_monster, ai.ignoring_monster_metadata())
+    old_ai = confused.ai
+    confused.ai = AI(ai.confused_monster, ai.confused_monster_metadata(old_ai))
+    confused.ai.set_owner(confused)
+
+    fleeing = monster(6, 6, ai.ignoring_monster, ai.ignoring_monster_metadata())
+    fleeing.old_ai = fleeing.ai
+    fleeing.ai = AI(ai.fleeing_monster, ai.hostile_monster_metadata(player))
+    fleeing.ai.set_owner(fleeing)
+    fleeing.fighter.last_attacker = player
+
+    home = algebra.Location(1, 1)
+    wanderer = monster(2, 2, ai.territorial_monster,
+                       ai.territorial_monster_metadata(home, 5))
+
+    deaths = []
+    bleeder = monster(2, 6, ai.ignoring_monster, ai.ignoring_monster_metadata())
+    bleeder.fighter.death_function = deaths.append
+    bleeder.fighter.bleeding = 10
+
+    new_map.left_turn = 0
+    player.turn_count = ai.CONFUSE_NUM_TURNS + 5
+    catch_up(new_map, player)
+    assert new_map.left_turn is None
+    assert confused.ai is old_ai
+    assert fleeing.ai is fleeing.old_ai
+    assert fleeing.fighter.last_attacker is None
+    assert deaths == [bleeder]
+
+    for i in range(50):
+        wanderer.ai._metadata.active_turns = 1
+        ai.pass_time(wanderer, 1)
+        assert new_map.loc_bound.contains(wanderer.pos)
+        assert wanderer.pos.distance(home) <= 5
+        assert not new_map.is_blocked_at(wanderer.pos, ignore=wanderer)
+        assert wanderer in new_map.objects_at(wanderer.pos)
+
+
+if __name__ == '__main__':
+    _test_slowed_player()
+    _test_catch_up()
+    print('Scheduler tests complete.')
@@ -31,9 +31,8 @@ def _target_monster(actor, max_range=None):
         if pos is None:
             return None
 
-        for obj in actor.current_map.objects:
-            if (obj.x == pos.x and obj.y == pos.y and obj.fighter and
-                    obj != actor):
+        for obj in actor.current_map.objects_at(pos):
+            if obj.fighter and obj != actor:
                 return obj
 
 
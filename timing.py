@@ -0,0 +1,63 @@
+"""
+Lightweight timing of each phase of every frame of the main loop.
+
+timing.begin_frame() closes the current frame record and starts another;
+  the last FRAME_HISTORY records are kept, oldest first, in timing.frames.
+started = timing.start(); ...; timing.record('phase', started)
+  adds the elapsed milliseconds to the current frame's 'phase'.
+timing.dump(path) writes the kept records as JSON.
+timing.show_hud toggles the renderer's on-screen readout of the last frame.
+"""
+# Copyright 2016 Thomas C. Hudson
+# Governed by the license described in LICENSE.txt
+import collections
+import json
+import time
+
+FRAME_HISTORY = 300
+DUMP_FILE = 'timing.json'
+
+frames = collections.deque(maxlen=FRAME_HISTORY)
+""" completed frame records: OrderedDict of phase name -> milliseconds """
+show_hud = False
+
+_current = None
+_frame_start = None
+
+
+def begin_frame():
+    global _current, _frame_start
+    now = time.time()
+    if _current is not None:
+        _current['frame'] = (now - _frame_start) * 1000
+        frames.append(_current)
+    _current = collections.OrderedDict()
+    _frame_start = now
+
+
+def start():
+    return time.time()
+
+
+def record(phase, started):
+    """
+    Charge the time since (started) to (phase) of the current frame;
+    a phase timed more than once in a frame accumulates.
+    """
+    if _current is None:
+        return
+    _current[phase] = _current.get(phase, 0.) + (time.time() - started) * 1000
+
+
+def last_frame():
+    """
+    Returns the most recently completed frame record, or None.
+    """
+    if not frames:
+        return None
+    return frames[-1]
+
+
+def dump(path=DUMP_FILE):
+    with open(path, 'w') as f:
+        json.dump(list(frames), f, indent=1)